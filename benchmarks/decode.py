@@ -0,0 +1,48 @@
+"""Compare decoding killmails with from_dict and with the generated decoders.
+
+The generated decoders decode attackers and items lazily, so they are timed both untouched and fully materialized.
+
+    python -m benchmarks.decode
+"""
+import json
+import timeit
+
+from utils.dataclass import (from_dict, Killmail)
+from utils.decoder import decode
+from benchmarks.synthetic import (make_killmail, KILLMAILS)
+
+
+def bench(body: bytes, number: int) -> dict:
+    """Time both decoders on one response body.
+
+    :param body: The killmail response body.
+    :param number: Number of times to decode it.
+    :return: The results in microseconds per killmail.
+    """
+    assert decode(Killmail, body) == from_dict(cls=Killmail, dictionary=json.loads(body.decode()))
+    reflective = timeit.timeit(lambda: from_dict(cls=Killmail, dictionary=json.loads(body.decode())), number=number)
+    generated = timeit.timeit(lambda: decode(Killmail, body), number=number)
+    materialized = timeit.timeit(lambda: materialize(decode(Killmail, body)), number=number)
+    return {'from_dict_us': reflective / number * 1e6,
+            'decode_us': generated / number * 1e6,
+            'decode_materialized_us': materialized / number * 1e6,
+            'speedup': reflective / generated,
+            'speedup_materialized': reflective / materialized}
+
+
+def materialize(killmail: Killmail) -> Killmail:
+    list(killmail.attackers)
+    list(killmail.victim.items)
+    return killmail
+
+
+def main():
+    results = {}
+    for name, (attackers, items) in KILLMAILS.items():
+        body = json.dumps(make_killmail(attackers=attackers, items=items)).encode()
+        results[name] = bench(body=body, number=max(20, 20000 // (attackers + items)))
+    print(json.dumps(results, indent=4))
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,68 @@
+"""Count outbound ESI requests when a killmail fans out to many concurrent lookups of the same system.
+
+Runs offline, ESI is replaced with a stub client that answers after a fixed latency.
+
+    python -m benchmarks.singleflight
+"""
+import asyncio
+import json
+import sys
+import types
+
+
+class StubResponse:
+    status = 200
+    content_type = 'application/json'
+    charset = 'utf-8'
+
+    def __init__(self, body: bytes):
+        self.body = body
+        self.headers = {}
+
+    async def read(self) -> bytes:
+        return self.body
+
+    async def __aenter__(self):
+        await asyncio.sleep(StubClient.latency)
+        return self
+
+    async def __aexit__(self, *args):
+        pass
+
+
+class StubClient:
+    latency = 0.005
+
+    def request(self, method, url, params=None, data=None, headers=None):
+        return StubResponse(json.dumps({'system_id': 30000142, 'security_status': 0.9}).encode())
+
+
+sys.modules.setdefault('cogs', types.SimpleNamespace(client=StubClient()))
+
+from utils import fetch  # noqa: E402
+
+
+async def fan_out(coro, killmails: int, filters: int) -> int:
+    """Look the system of every killmail up once per filter, all filters at the same time.
+
+    :return: The number of outbound requests made.
+    """
+    before = fetch.counters['requests'].value
+    for killmail in range(killmails):
+        fetch.cache.entries.clear()
+        await asyncio.gather(*[coro(url=f'https://esi.evetech.net/latest/universe/systems/{30000000 + killmail}/',
+                                    params=fetch.esi_params) for _ in range(filters)])
+    return fetch.counters['requests'].value - before
+
+
+async def main(killmails: int = 100, filters: int = 50) -> dict:
+    uncoalesced = await fan_out(fetch.request, killmails=killmails, filters=filters)
+    coalesced = await fan_out(fetch.fetch, killmails=killmails, filters=filters)
+    return {'killmails': killmails,
+            'filters': filters,
+            'requests_per_killmail_without_single_flight': uncoalesced / killmails,
+            'requests_per_killmail_with_single_flight': coalesced / killmails}
+
+
+if __name__ == '__main__':
+    print(json.dumps(asyncio.get_event_loop().run_until_complete(main())))
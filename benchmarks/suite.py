@@ -0,0 +1,223 @@
+"""Benchmark suite for the matching hot path.
+
+Runs entirely offline on synthetic configs and killmails, and writes the results as JSON so commits can be compared.
+
+    python -m benchmarks.suite [--quick] [--output results.json]
+"""
+import argparse
+import asyncio
+import json
+import os
+import platform
+import subprocess
+import tempfile
+import time
+
+from utils.dataclass import (from_dict, Filter, Zkb, Killmail)
+from utils.decoder import decode
+from utils.file import write
+from utils.index import FilterIndex
+from utils.pool import MatcherPool
+from utils.predicate import compile_filter
+from benchmarks import (decode as decode_benchmark, singleflight)
+from benchmarks.synthetic import (make_universe, make_config, make_killmail, make_zkb, KILLMAILS)
+
+
+CONFIGS = {'quick': [(10, 5, 100), (100, 5, 1000)],
+           'full': [(10, 5, 100), (100, 5, 1000), (500, 10, 1000), (1000, 10, 5000)]}
+
+PREDICATES = {'isk_value': {'isk_value': 10 ** 8},
+              'where': {'where': 'systems'},
+              'what_kill': {'what': 'ships', 'action': 'kill'},
+              'what_use': {'what': 'ships', 'action': 'use'},
+              'who_kill': {'who': 'entities', 'action': 'kill'},
+              'who_use': {'who': 'entities', 'action': 'use'},
+              'who_ignore_use': {'who_ignore': 'entities', 'action': 'use'},
+              'items': {'items': 'items'},
+              'security_status': {'lowest_security': -1.0, 'highest_security': 0.5},
+              'range': {'range': 10}}
+
+
+def measure(func, min_time: float = 0.2) -> float:
+    """Call a function repeatedly for at least min_time seconds.
+
+    :param func: The function.
+    :param min_time: Minimum total time in seconds.
+    :return: Seconds per call.
+    """
+    calls = 0
+    start = time.perf_counter()
+    elapsed = 0
+    while elapsed < min_time:
+        func()
+        calls += 1
+        elapsed = time.perf_counter() - start
+    return elapsed / calls
+
+
+def bench_decode() -> dict:
+    results = {}
+    for name, (attackers, items) in KILLMAILS.items():
+        body = json.dumps(make_killmail(attackers=attackers, items=items)).encode()
+        results[name] = decode_benchmark.bench(body=body, number=max(20, 20000 // (attackers + items)))
+    return results
+
+
+def bench_match(configs: list, universe) -> dict:
+    """Decode killmails and match them against every filter of every guild, like process_killmail does.
+
+    :param configs: Tuples of number of guilds, filters per guild and list size.
+    :param universe: The universe.
+    :return: The results by config and killmail size.
+    """
+    results = {}
+    for guilds, filters, list_size in configs:
+        config = make_config(guilds=guilds, filters=filters, list_size=list_size, systems=len(universe.systems))
+        index = FilterIndex(universe=universe)
+        start = time.perf_counter()
+        for guild in config.guilds:
+            index.update(guild)
+        build = time.perf_counter() - start
+
+        scenario = {'index_build_ms': build * 1000}
+        for name, (attackers, items) in KILLMAILS.items():
+            bodies = [(decode(Zkb, make_zkb(seed=seed)),
+                       json.dumps(make_killmail(attackers=attackers, items=items, seed=seed)).encode())
+                      for seed in range(50)]
+            matches = sum(len(index.match(zkb=zkb, killmail=decode(Killmail, body, skip=index.skip)))
+                          for zkb, body in bodies)
+
+            def run():
+                for zkb, body in bodies:
+                    index.match(zkb=zkb, killmail=decode(Killmail, body, skip=index.skip))
+
+            seconds = measure(run) / len(bodies)
+            scenario[name] = {'killmails_per_second': 1 / seconds,
+                              'us_per_killmail': seconds * 1e6,
+                              'matches_per_killmail': matches / len(bodies)}
+        results[f'{guilds}x{filters}x{list_size}'] = scenario
+    return results
+
+
+def bench_predicates(universe) -> dict:
+    """Time every kind of compiled predicate on its own.
+
+    :param universe: The universe.
+    :return: The results in nanoseconds per evaluation, by predicate and killmail size.
+    """
+    guild = next(iter(make_config(guilds=1, filters=0, list_size=1000, systems=len(universe.systems)).guilds))
+    zkb = decode(Zkb, make_zkb())
+    results = {}
+    for name, kwargs in PREDICATES.items():
+        filt = from_dict(cls=Filter, dictionary={'name': name, **kwargs})
+        predicate = compile_filter(filt=filt, lists=guild.lists, staging=guild.staging, universe=universe)
+        results[name] = {}
+        for size, (attackers, items) in KILLMAILS.items():
+            killmail = decode(Killmail, make_killmail(attackers=attackers, items=items))
+            results[name][size] = measure(lambda: predicate(zkb, killmail), min_time=0.05) * 1e9
+    return results
+
+
+def bench_save(configs: list) -> dict:
+    """Time copying and writing the config, like a flush of the saver does.
+
+    :param configs: Tuples of number of guilds, filters per guild and list size.
+    :return: The results by config.
+    """
+    results = {}
+    directory = tempfile.mkdtemp(prefix='kverna-bench-')
+    path = os.path.join(directory, 'config.json')
+    for guilds, filters, list_size in configs:
+        config = make_config(guilds=guilds, filters=filters, list_size=list_size)
+        for guild in config.guilds:
+            for killmail_id in range(1000):
+                config.guilds.add_reported(guild_id=guild.id, killmail_id=killmail_id, time='2018-10-18T12:00:00Z')
+
+        def snapshot_all():
+            config.guilds.dirty = set(config.guilds.guilds)
+            return config.to_json()
+
+        def snapshot_one():
+            config.guilds.add_reported(guild_id=0, killmail_id=0, time='2018-10-18T12:00:00Z')
+            config.guilds.dirty.add(0)
+            return config.to_json()
+
+        results[f'{guilds}x{filters}x{list_size}'] = {
+            'snapshot_ms': measure(snapshot_all, min_time=0.1) * 1000,
+            'snapshot_one_dirty_ms': measure(snapshot_one, min_time=0.1) * 1000,
+            'save_ms': measure(lambda: write(path, snapshot_all()), min_time=0.1) * 1000,
+            'file_bytes': os.path.getsize(path)}
+    return results
+
+
+def bench_pool(config: tuple, universe, loop) -> dict:
+    """Match killmails in a matcher pool with an increasing number of worker processes.
+
+    :param config: Tuple of number of guilds, filters per guild and list size.
+    :param universe: The universe.
+    :param loop: The event loop.
+    :return: The results by number of processes and killmail size.
+    """
+    guilds, filters, list_size = config
+    config = make_config(guilds=guilds, filters=filters, list_size=list_size, systems=len(universe.systems))
+    results = {}
+    processes = 1
+    while processes <= (os.cpu_count() or 1):
+        pool = MatcherPool(processes=processes, universe=universe)
+        for guild in config.guilds:
+            pool.update(guild)
+        results[processes] = {}
+        for name, (attackers, items) in KILLMAILS.items():
+            killmails = [(decode(Zkb, make_zkb(seed=seed)),
+                          json.dumps(make_killmail(attackers=attackers, items=items, seed=seed)).encode())
+                         for seed in range(50)]
+
+            async def run():
+                for zkb, body in killmails:
+                    await pool.match(zkb=zkb, killmail=decode(Killmail, body, skip=frozenset(['attackers', 'items'])),
+                                     killmail_data=body)
+
+            loop.run_until_complete(run())
+            seconds = measure(lambda: loop.run_until_complete(run())) / len(killmails)
+            results[processes][name] = {'killmails_per_second': 1 / seconds}
+        pool.shutdown()
+        processes *= 2
+    return results
+
+
+def commit() -> [str, None]:
+    try:
+        return subprocess.check_output(['git', 'rev-parse', 'HEAD'], stderr=subprocess.DEVNULL).decode().strip()
+    except (OSError, subprocess.CalledProcessError):
+        return None
+
+
+def main():
+    parser = argparse.ArgumentParser(description='Benchmark the matching hot path.')
+    parser.add_argument('--quick', action='store_true', help='only run the smaller configs')
+    parser.add_argument('--output', help='write the results to this file instead of stdout')
+    args = parser.parse_args()
+
+    configs = CONFIGS['quick' if args.quick else 'full']
+    universe = make_universe()
+    loop = asyncio.get_event_loop()
+    results = {'commit': commit(),
+               'python': platform.python_version(),
+               'time': time.strftime('%Y-%m-%dT%H:%M:%SZ', time.gmtime()),
+               'decode': bench_decode(),
+               'match': bench_match(configs=configs, universe=universe),
+               'predicates': bench_predicates(universe=universe),
+               'save': bench_save(configs=configs),
+               'pool': bench_pool(config=configs[-1], universe=universe, loop=loop),
+               'single_flight': loop.run_until_complete(singleflight.main())}
+
+    output = json.dumps(results, indent=4)
+    if args.output:
+        with open(args.output, mode='w') as file:
+            file.write(output)
+    else:
+        print(output)
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,140 @@
+"""Synthetic universes, configs and killmails for the benchmarks."""
+import random
+
+from utils.dataclass import (from_dict, Config, SolarSystem, Constellation, Region)
+from utils.universe import Universe
+
+
+FIRST_SYSTEM_ID = 30000001
+LIGHT_YEAR = 9.4607 * 10 ** 15
+
+
+def make_universe(systems: int = 5000, seed: int = 0) -> Universe:
+    """Make a universe with systems spread out in a cube about 100 light years wide.
+
+    :param systems: Number of solar systems.
+    :param seed: Seed for the random values.
+    :return: The universe.
+    """
+    rng = random.Random(seed)
+    constellation_ids = list(range(20000001, 20000001 + max(systems // 8, 1)))
+    solar_systems = {}
+    for system_id in range(FIRST_SYSTEM_ID, FIRST_SYSTEM_ID + systems):
+        solar_systems[system_id] = from_dict(cls=SolarSystem, dictionary={
+            'system_id': system_id,
+            'name': f'J{system_id}',
+            'constellation_id': rng.choice(constellation_ids),
+            'security_status': round(rng.uniform(-1, 1), 2),
+            'position': {axis: rng.uniform(-50, 50) * LIGHT_YEAR for axis in 'xyz'}})
+    constellations = {constellation_id: from_dict(cls=Constellation, dictionary={
+        'constellation_id': constellation_id,
+        'name': f'C{constellation_id}',
+        'region_id': 10000001,
+        'systems': [system.system_id for system in solar_systems.values()
+                    if system.constellation_id == constellation_id]}) for constellation_id in constellation_ids}
+    regions = {10000001: from_dict(cls=Region, dictionary={'region_id': 10000001,
+                                                           'name': 'R10000001',
+                                                           'constellations': constellation_ids})}
+    return Universe(systems=solar_systems, constellations=constellations, regions=regions)
+
+
+def make_config(guilds: int, filters: int, list_size: int, systems: int = 5000, seed: int = 0) -> Config:
+    """Make a config with guilds that each have a mix of filters and lists.
+
+    :param guilds: Number of guilds.
+    :param filters: Number of filters per guild.
+    :param list_size: Number of IDs in each list.
+    :param systems: Number of solar systems in the universe the lists refer to.
+    :param seed: Seed for the random values.
+    :return: The config.
+    """
+    rng = random.Random(seed)
+    system_ids = range(FIRST_SYSTEM_ID, FIRST_SYSTEM_ID + systems)
+    config = []
+    for guild_id in range(guilds):
+        lists = {'systems': rng.sample(system_ids, min(list_size, systems)),
+                 'ships': rng.sample(range(580, 60000), list_size),
+                 'entities': rng.sample(range(90000000, 99010000), list_size),
+                 'items': rng.sample(range(34, 60000), list_size)}
+        guild_filters = []
+        for number in range(filters):
+            kind = number % 6
+            filt = {'name': f'filter{number}', 'action': rng.choice(['kill', 'use'])}
+            if kind == 0:
+                filt.update(where='systems', isk_value=rng.randint(0, 10 ** 9))
+            elif kind == 1:
+                filt.update(what='ships', lowest_security=-1.0, highest_security=0.0)
+            elif kind == 2:
+                filt.update(who='entities', who_ignore='ships')
+            elif kind == 3:
+                filt.update(items='items')
+            elif kind == 4:
+                filt.update(range=rng.choice([5, 10, 15]))
+            else:
+                filt.update(isk_value=rng.randint(10 ** 9, 10 ** 11))
+            guild_filters.append(filt)
+        config.append({'id': guild_id,
+                       'channel': guild_id,
+                       'staging': rng.choice(system_ids),
+                       'lists': lists,
+                       'filters': guild_filters,
+                       'reported_killmail_id': {}})
+    return from_dict(cls=Config, dictionary={'guilds': config})
+
+
+def make_killmail(attackers: int, items: int, systems: int = 5000, seed: int = 0) -> dict:
+    """Make a synthetic killmail shaped like the ESI killmail response.
+
+    :param attackers: Number of attackers.
+    :param items: Number of items in the victims hold.
+    :param systems: Number of solar systems in the universe.
+    :param seed: Seed for the random values.
+    :return: The killmail as a dictionary.
+    """
+    rng = random.Random(seed)
+    return {
+        'killmail_id': rng.randint(70000000, 80000000),
+        'killmail_time': '2018-10-18T12:00:00Z',
+        'solar_system_id': rng.randint(FIRST_SYSTEM_ID, FIRST_SYSTEM_ID + systems - 1),
+        'attackers': [{'alliance_id': rng.randint(99000000, 99010000),
+                       'character_id': rng.randint(90000000, 95000000),
+                       'corporation_id': rng.randint(98000000, 98700000),
+                       'damage_done': rng.randint(0, 50000),
+                       'final_blow': index == 0,
+                       'security_status': round(rng.uniform(-10, 5), 1),
+                       'ship_type_id': rng.randint(580, 60000),
+                       'weapon_type_id': rng.randint(580, 60000)} for index in range(attackers)],
+        'victim': {'alliance_id': rng.randint(99000000, 99010000),
+                   'character_id': rng.randint(90000000, 95000000),
+                   'corporation_id': rng.randint(98000000, 98700000),
+                   'damage_taken': rng.randint(1000, 5000000),
+                   'items': [{'flag': rng.randint(5, 180),
+                              'item_type_id': rng.randint(34, 60000),
+                              'quantity_destroyed': rng.randint(0, 1000),
+                              'singleton': 0} for _ in range(items)],
+                   'position': {'x': rng.uniform(-1e12, 1e12),
+                                'y': rng.uniform(-1e12, 1e12),
+                                'z': rng.uniform(-1e12, 1e12)},
+                   'ship_type_id': rng.randint(580, 60000)},
+    }
+
+
+def make_zkb(seed: int = 0) -> dict:
+    """Make synthetic zKillboard data for a killmail.
+
+    :param seed: Seed for the random values.
+    :return: The zKillboard data as a dictionary.
+    """
+    rng = random.Random(seed)
+    return {'locationID': 40000001,
+            'hash': '%040x' % rng.getrandbits(160),
+            'fittedValue': rng.randint(10 ** 6, 10 ** 9),
+            'totalValue': rng.randint(10 ** 6, 10 ** 10),
+            'points': rng.randint(1, 100),
+            'npc': False,
+            'solo': False,
+            'awox': False,
+            'href': 'https://esi.evetech.net/latest/killmails/1/hash/'}
+
+
+KILLMAILS = {'small': (1, 5), 'average': (15, 40), 'fleet_fight': (1000, 300)}
@@ -1,10 +1,51 @@
 import asyncio
-import aiohttp
-from utils.file import load
+import configparser
+import os
+from utils.file import (load, saver, CONFIG_FILE)
+from utils.client import (Client, TokenBucket, make_session)
+from utils.dedup import ReportedKillmails
 
 
+bot_config = configparser.ConfigParser()
+bot_config.read('config/bot.ini')
+
+ReportedKillmails.retention_days = bot_config['intel'].getint('reported_retention_days')
+saver.delay = bot_config['intel'].getint('save_delay_ms') / 1000
+
+# Every shard process only loads the guilds of its own shard, and writes them back into the same config file.
+# The shard can be set in the environment, so several shards can run from the same directory.
+shard_id = int(os.environ.get('KVERNA_SHARD_ID', bot_config['shard']['shard_id']))
+shard_count = int(os.environ.get('KVERNA_SHARD_COUNT', bot_config['shard']['shard_count']))
+if shard_count > 1:
+    saver.shard = (shard_id, shard_count)
+
 loop = asyncio.get_event_loop()
-config = loop.run_until_complete(load())
+config = loop.run_until_complete(load(CONFIG_FILE, shard=saver.shard))
 
 headers = {"User-Agent": "kverna"}
-session = aiohttp.ClientSession(headers=headers, loop=loop)
+client_config = bot_config['client']
+session = make_session(headers=headers,
+                       limit_per_host=client_config.getint('esi_limit_per_host'),
+                       timeout=client_config.getfloat('esi_timeout'),
+                       keepalive_timeout=client_config.getfloat('keepalive_timeout'),
+                       dns_cache_ttl=client_config.getint('dns_cache_ttl'),
+                       loop=loop)
+redisq_session = make_session(headers=headers,
+                              limit_per_host=client_config.getint('redisq_limit_per_host'),
+                              timeout=client_config.getfloat('redisq_timeout'),
+                              keepalive_timeout=client_config.getfloat('keepalive_timeout'),
+                              dns_cache_ttl=client_config.getint('dns_cache_ttl'),
+                              loop=loop)
+# The killstream WebSocket stays open for as long as the bot runs, so only connecting to it has a timeout.
+websocket_session = make_session(headers=headers,
+                                 limit_per_host=1,
+                                 timeout=None,
+                                 keepalive_timeout=client_config.getfloat('keepalive_timeout'),
+                                 dns_cache_ttl=client_config.getint('dns_cache_ttl'),
+                                 loop=loop,
+                                 connect_timeout=client_config.getfloat('websocket_connect_timeout'))
+client = Client(default=session,
+                sessions={'redisq.zkillboard.com': redisq_session},
+                limiters={'esi.evetech.net': TokenBucket(rate=client_config.getfloat('esi_rate'),
+                                                         burst=client_config.getint('esi_burst'),
+                                                         error_threshold=client_config.getint('esi_error_threshold'))})
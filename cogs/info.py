@@ -17,13 +17,13 @@ class Info:
     @commands.command(name='info')
     async def info(self, ctx):
         """Provide some simple information about the bot."""
-        guild: Guild = discord.utils.find(lambda g: g.id == ctx.guild.id, config.guilds)
+        guild: Guild = config.guilds.get(ctx.guild.id)
         embed = discord.Embed(title='kverna',
                               description=bot_config['default']['long_description'],
                               color=discord.Color.blue())
         embed.add_field(name="Server count", value=f"{len(self.bot.guilds)}")
         embed.add_field(name="Kills reported",
-                        value=f"{len(guild.reported_killmail_id)} to this server")
+                        value=f"{guild.reported_count} to this server")
         embed.add_field(name="Invite",
                         value=f"{bot_config['default']['invite_link']}")
         await ctx.send(embed=embed)
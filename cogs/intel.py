@@ -2,336 +2,346 @@ from discord.ext import commands
 import logging
 import asyncio
 import datetime
+import glob
+from time import perf_counter
 
 from utils.decorator import (logger, timeit)
-from utils.fetch import (fetch, esi_systems)
-from utils.dataclass import (from_dict, Killmail, Zkb, Guild, Filter, Position)
+from utils.fetch import (fetch, esi_regions, esi_constellations, esi_systems,
+                         esi_region_ids, esi_constellation_ids, esi_system_ids)
+from utils.dataclass import (from_dict, Killmail, Zkb, Guild, Filter, Position, SolarSystem, Constellation, Region)
 from utils.file import save
-from . import config
+from utils.decoder import decode
+from utils.index import FilterIndex
+from utils.universe import (load_universe, save_universe, fetch_complete)
+from utils.journal import (Journal, JOURNAL_FILE)
+from utils.source import (Source, make_source)
+from utils.metrics import registry
+from utils.delivery import Delivery
+from utils.pool import MatcherPool
+from . import (bot_config, config, websocket_session, shard_id, shard_count)
 
 
 log = logging.getLogger('discord')
 
+universe = load_universe()
+index = FilterIndex(universe=universe)
+intel_config = bot_config['intel']
+journal = Journal(path=f'config/reported.shard-{shard_id}.jsonl' if shard_count > 1 else JOURNAL_FILE,
+                  compact_every=intel_config.getint('journal_compact_every'))
+queue = asyncio.Queue(maxsize=intel_config.getint('queue_size'))
+pipeline = {'received': 0, 'processed': 0, 'backpressure': 0, 'max_depth': 0}
+delivery_config = bot_config['delivery']
+delivery = Delivery(window=delivery_config.getint('window_ms') / 1000,
+                    rate=delivery_config.getfloat('rate'),
+                    burst=delivery_config.getint('burst'),
+                    max_length=delivery_config.getint('max_length'),
+                    retry_delay=delivery_config.getint('retry_delay_ms') / 1000)
+# Guild and killmail IDs of reports waiting to be posted, they are only marked reported once they are posted.
+delivering = set()
+
+metrics = {'fetch': registry.histogram('kverna_killmail_fetch_seconds', 'Time spent fetching killmails from ESI.'),
+           'decode': registry.histogram('kverna_killmail_decode_seconds', 'Time spent decoding killmails.'),
+           'match': registry.histogram('kverna_filter_evaluation_seconds', 'Time spent matching a killmail.'),
+           'killmails': registry.counter('kverna_killmails_total', 'Killmails processed.'),
+           'matches': registry.counter('kverna_matches_total', 'Filter matches.'),
+           'errors': registry.counter('kverna_killmail_errors_total', 'Killmails that failed to process.')}
+registry.gauge('kverna_queue_depth', 'Killmails waiting to be evaluated.', queue.qsize)
+registry.counter('kverna_queue_backpressure_total', 'Times the listener waited for room in the queue.',
+                 func=lambda: pipeline['backpressure'])
+
+
+def make_intel_source() -> Source:
+    """Make the killmail source selected in the config.
+
+    :return: The source.
+    :raises ValueError: When the source is not configured properly.
+    """
+    return make_source(source_config=intel_config, fetch=fetch, session=websocket_session, shard_id=shard_id)
+
 
-async def listen(bot: commands.Bot):
-    """Listen for new killmail to be available from the zKillboard redisQ.
+async def listen(bot: commands.Bot, source: Source):
+    """Listen for new killmail to be available from the source and process them.
 
-    When a new killmail is available, fetch it and process it.
+    The listener feeds a bounded queue that is drained by a number of evaluation workers.
+    When the workers fall behind, the queue fills up and the listener stops polling until there is room again.
 
     :param bot: The discord bot.
+    :param source: The killmail source.
     :return: None.
     """
     await bot.wait_until_ready()
 
-    url = 'https://redisq.zkillboard.com/listen.php'
+    if not universe.systems:
+        asyncio.ensure_future(build_universe())
 
-    while True:  # TODO: Check connection status
-        log.debug('listening')
-        zkb_data = await fetch(url=url)
+    for _ in range(intel_config.getint('workers')):
+        asyncio.ensure_future(evaluate(bot=bot))
 
-        if type(zkb_data) is dict and zkb_data is not None and zkb_data.get('package') is not None:
-            zkb = from_dict(cls=Zkb, dictionary=zkb_data.get('package').get('zkb'))
+    await ingest(source=source)
 
-            await asyncio.sleep(0.0001)
 
-            killmail_data = await fetch(url=zkb.href)
+async def ingest(source: Source):
+    """Put every package from the source on the queue.
 
-            if type(killmail_data) is dict and killmail_data is not None:
-                killmail = from_dict(cls=Killmail, dictionary=killmail_data)
+    :param source: The killmail source.
+    :return: None.
+    """
+    async for package in source:
+        pipeline['received'] += 1
+        if queue.full():
+            pipeline['backpressure'] += 1
+            log.warning(f'Killmail queue is full ({queue.qsize()}), waiting for the workers')
+        await queue.put(package)
+        pipeline['max_depth'] = max(pipeline['max_depth'], queue.qsize())
 
-                await asyncio.sleep(0.0001)
 
-                asyncio.create_task(process_killmail(zkb=zkb, killmail=killmail, bot=bot))
-        else:
-            await asyncio.sleep(2)
+async def evaluate(bot: commands.Bot):
+    """Take packages off the queue, decode them and process the killmail.
+
+    The killmail embedded in the package is used, it is only fetched from ESI when it is missing.
+
+    :param bot: The discord bot.
+    :return: None.
+    """
+    while True:
+        package = await queue.get()
+        try:
+            zkb = decode(Zkb, package.get('zkb'))
+            killmail_data = package.get('killmail')
+            if killmail_data is None:
+                start_time = perf_counter()
+                killmail_data = await fetch(url=zkb.href, raw=True)
+                metrics['fetch'].observe(perf_counter() - start_time)
+            start_time = perf_counter()
+            killmail = decode(Killmail, killmail_data, skip=index.skip)
+            metrics['decode'].observe(perf_counter() - start_time)
+            await process_killmail(zkb=zkb, killmail=killmail, bot=bot, killmail_data=killmail_data)
+        except Exception as e:
+            metrics['errors'].inc()
+            log.error(f'Failed to process package {package.get("killID")}: {e!r}')
+        finally:
+            pipeline['processed'] += 1
+            queue.task_done()
 
 
 @timeit
 @logger
-async def process_killmail(zkb: Zkb, killmail: Killmail, bot: commands.Bot):
-    """Process the kill by processing each filter in each guild and look for any matching attributes.
+async def process_killmail(zkb: Zkb, killmail: Killmail, bot: commands.Bot, killmail_data: [bytes, dict] = None):
+    """Process the kill by looking up the filters that could match it and evaluating their predicates.
+
+    With a matcher pool the killmail is matched in the worker processes instead.
 
     :param zkb: The zKillboard data for this killmail.
     :param killmail: The killmail.
     :param bot: The discord bot.
+    :param killmail_data: The killmail as it was received, sent to the matcher pool.
     :return: None.
     """
     log.info(f'processing killmail {killmail.killmail_id}')
-    for guild in config.guilds:
-        if guild.reported_killmail_id.get(killmail.killmail_id) is not None:
-            return
-        for filt in guild.filters:
-            if filt.enabled:
-                asyncio.create_task(process_filter(zkb=zkb, killmail=killmail, guild=guild, filt=filt, bot=bot))
-                await asyncio.sleep(0.0001)
+    start_time = perf_counter()
+    if pool is not None and killmail_data is not None:
+        matches = await pool.match(zkb=zkb, killmail=killmail, killmail_data=killmail_data)
+    else:
+        matches = index.match(zkb=zkb, killmail=killmail)
+    metrics['match'].observe(perf_counter() - start_time)
+    metrics['killmails'].inc()
+    metrics['matches'].inc(len(matches))
+    await asyncio.gather(*[process_filter(zkb=zkb, killmail=killmail, guild=match.guild, filt=match.filt, bot=bot)
+                           for match in matches])
 
 
 @timeit
 @logger
 async def process_filter(zkb: Zkb, killmail: Killmail, guild: Guild, filt: Filter, bot: commands.Bot):
-    if killmail.killmail_id in guild.reported_killmail_id:
-        return
+    """Report a killmail that matched a filter to the guild channel.
 
-    coros = []
-    await asyncio.sleep(0.0001)
-
-    if filt.where:
-        coros.append(is_where(killmail=killmail, guild=guild, filt=filt))
-
-    if filt.isk_value:
-        coros.append(is_expensive(zkb=zkb, filt=filt))
-
-    if filt.range and guild.staging:
-        coros.append(is_in_range(killmail=killmail, guild=guild, filt=filt))
-
-    if filt.items:
-        coros.append(has_items(killmail=killmail, guild=guild, filt=filt))
-
-    if filt.lowest_security is not None:
-        coros.append(security_status_low(killmail=killmail, filt=filt))
-
-    if filt.highest_security is not None:
-        coros.append(security_status_high(killmail=killmail, filt=filt))
-
-    if filt.action == 'use':
-        if filt.what:
-            coros.append(is_what_attacker(killmail=killmail, guild=guild, filt=filt))
-
-        if filt.who:
-            coros.append(is_who_attacker(killmail=killmail, guild=guild, filt=filt))
-
-        if filt.who_ignore:
-            coros.append(is_who_ignore_attacker(killmail=killmail, guild=guild, filt=filt))
-
-    elif filt.action == 'kill':
-        if filt.what:
-            coros.append(is_what_victim(killmail=killmail, guild=guild, filt=filt))
-
-        if filt.who:
-            coros.append(is_who_victim(killmail=killmail, guild=guild, filt=filt))
-
-        if filt.who_ignore:
-            coros.append(is_who_ignore_victim(killmail=killmail, guild=guild, filt=filt))
-
-    else:
-        log.error(f'{guild.id} {filt.name} missing action')
-
-    matching = await asyncio.gather(*coros)
-
-    # TODO: Update the message with embeds and more info
-    if False not in matching:
-        if killmail.killmail_id not in guild.reported_killmail_id:
-            await add_reported_killmail_id(killmail=killmail, guild=guild)
-            channel = bot.get_channel(guild.channel)
-            if filt.ping:
-                await channel.send(
-                    f'@here '
-                    f'https://zkillboard.com/kill/{killmail.killmail_id} '
-                    f'matched {filt.name}')
-            else:
-                await channel.send(
-                    f'https://zkillboard.com/kill/{killmail.killmail_id}/ '
-                    f'matched {filt.name}')
-
-
-@timeit
-@logger
-async def add_reported_killmail_id(killmail: Killmail, guild: Guild):
-    """Add reported kills to the guilds reported kills list.
+    The report is queued for delivery, so posting to Discord does not hold up the evaluation. The killmail is marked
+    reported to the guild once the report is posted.
+    Until the universe store is built, the range and security status of the filter are checked with ESI first.
 
+    :param zkb: The zKillboard data for this killmail.
     :param killmail: The killmail.
     :param guild: The guild.
+    :param filt: The filter that matched.
+    :param bot: The discord bot.
+    :return: None.
     """
-    datetime_format = '%Y-%m-%dT%H:%M:%SZ'
-    time = datetime.datetime.utcnow()
-    config.guilds.remove(guild)
-    guild.reported_killmail_id[killmail.killmail_id] = time.strftime(datetime_format)
-    config.guilds.append(guild)
-    await save(config)
+    if not universe.systems and not await matches_with_esi(killmail=killmail, guild=guild, filt=filt):
+        return
 
+    # TODO: Update the message with embeds and more info
+    key = (guild.id, killmail.killmail_id)
+    if killmail.killmail_id not in guild.reported_killmail_id and key not in delivering:
+        delivering.add(key)
+        if filt.ping:
+            content = f'@here https://zkillboard.com/kill/{killmail.killmail_id} matched {filt.name}'
+        else:
+            content = f'https://zkillboard.com/kill/{killmail.killmail_id}/ matched {filt.name}'
 
-@timeit
-@logger
-async def is_expensive(zkb: Zkb, filt: Filter) -> bool:
-    """Check if the total value is greater than or equal to the value set in the filter.
+        async def done(sent: bool):
+            delivering.discard(key)
+            if sent:
+                await add_reported_killmail_id(killmail=killmail, guild=guild)
 
-    :param zkb: The killmail
-    :param filt: The filter
-    :return: True if the total value is greater than or equal to the value set in the filter
-    """
-    return zkb.totalValue >= filt.isk_value
+        if not delivery.submit(channel=bot.get_channel(guild.channel), content=content,
+                               since=killmail_timestamp(killmail), done=done):
+            delivering.discard(key)
 
 
 @timeit
 @logger
-async def is_where(killmail: Killmail, guild: Guild, filt: Filter) -> bool:
-    """Check if the solar system matches with the systems in the list referenced in the filter.
+async def matches_with_esi(killmail: Killmail, guild: Guild, filt: Filter) -> bool:
+    """Check the range and security status of a filter by looking the solar systems up in ESI.
 
-    :param killmail: The killmail.
-    :param guild: The guild.
-    :param filt: The filter.
-    :return: True if the solar system matches with the systems in the list referenced in the filter.
-    """
-    return killmail.solar_system_id in guild.lists.get(filt.where)
-
-
-@timeit
-@logger
-async def is_in_range(killmail: Killmail, guild: Guild, filt: Filter) -> bool:
-    """Check if the solar system is in range of the staging system.
+    Only used while the universe store is empty, the compiled predicates check these locally once it is built.
 
     :param killmail: The killmail.
     :param guild: The guild.
     :param filt: The filter.
-    :return: True if the solar system is in range of the staging system.
+    :return: True if the solar system is in range of the staging system and within the security status limits.
     """
-    staging_system = await esi_systems(guild.staging)
-    kill_system = await esi_systems(killmail.solar_system_id)
-
-    staging_position = from_dict(cls=Position, dictionary=staging_system.get('position'))
-    kill_position = from_dict(cls=Position, dictionary=kill_system.get('position'))
-    distance = staging_position.distance_in_light_years(kill_position)
-    return distance <= filt.range
+    in_range = filt.range and guild.staging
+    if not in_range and filt.lowest_security is None and filt.highest_security is None:
+        return True
 
-
-@timeit
-@logger
-async def is_what_victim(killmail: Killmail, guild: Guild, filt: Filter) -> bool:
-    """Check if the victim ship is in the filters 'what' list.
+    kill_system = await esi_systems(killmail.solar_system_id)
+    if kill_system.get('security_status') is None:
+        return False
+    security_status = float(kill_system.get('security_status'))
+    if filt.lowest_security is not None and security_status < filt.lowest_security:
+        return False
+    if filt.highest_security is not None and security_status > filt.highest_security:
+        return False
+
+    if in_range:
+        staging_system = await esi_systems(guild.staging)
+        if staging_system.get('position') is None:
+            return False
+        staging_position = from_dict(cls=Position, dictionary=staging_system.get('position'))
+        kill_position = from_dict(cls=Position, dictionary=kill_system.get('position'))
+        return staging_position.distance_in_light_years(kill_position) <= filt.range
+    return True
+
+
+def killmail_timestamp(killmail: Killmail) -> float:
+    """Get the unix time the kill happened.
 
     :param killmail: The killmail.
-    :param guild: The guild.
-    :param filt: The filter.
-    :return: True if the victim ship is in the filters 'what' list.
+    :return: The unix time.
     """
-    return killmail.victim.ship_type_id in guild.lists.get(filt.what)
+    killmail_time = datetime.datetime.strptime(killmail.killmail_time, '%Y-%m-%dT%H:%M:%SZ')
+    return killmail_time.replace(tzinfo=datetime.timezone.utc).timestamp()
 
 
 @timeit
 @logger
-async def is_what_attacker(killmail: Killmail, guild: Guild, filt: Filter) -> bool:
-    """Check if an attackers ship is in the filters 'what' list.
-
-    :param killmail: The killmail.
-    :param guild: The guild.
-    :param filt: The filter.
-    :return: True if an attackers ship is in the filters 'what' list.
-    """
-    matching = [attacker.ship_type_id in guild.lists.get(filt.what) for attacker in killmail.attackers]
-    return True in matching
-
+async def add_reported_killmail_id(killmail: Killmail, guild: Guild):
+    """Add reported kills to the guilds reported kills list.
 
-@timeit
-@logger
-async def is_who_victim(killmail: Killmail, guild: Guild, filt: Filter) -> bool:
-    """Check if the victim is in the filters 'who' list.
+    The kill is appended to the journal, the config is only saved when the journal is compacted.
 
     :param killmail: The killmail.
     :param guild: The guild.
-    :param filt: The filter.
-    :return: True if the victim is in the filters 'who' list.
     """
-    ids = {killmail.victim.alliance_id,
-           killmail.victim.corporation_id,
-           killmail.victim.character_id,
-           killmail.victim.faction_id}
-    return bool(ids.intersection(guild.lists.get(filt.who)))
+    datetime_format = '%Y-%m-%dT%H:%M:%SZ'
+    time = datetime.datetime.utcnow().strftime(datetime_format)
+    config.guilds.add_reported(guild_id=guild.id, killmail_id=killmail.killmail_id, time=time)
+    if journal.append(guild_id=guild.id, killmail_id=killmail.killmail_id, time=time):
+        await compact_journal()
 
 
 @timeit
 @logger
-async def is_who_ignore_victim(killmail: Killmail, guild: Guild, filt: Filter) -> bool:
-    """Check if the victim is in the filters 'who_ignore' list.
+async def compact_journal():
+    """Save the reported kills in the journal to the config and start a new journal.
 
-    :param killmail: The killmail.
-    :param guild: The guild.
-    :param filt: The filter.
-    :return: True if the victim is in the filters 'who_ignore' list.
+    :return: None.
     """
-    ids = {killmail.victim.alliance_id,
-           killmail.victim.corporation_id,
-           killmail.victim.character_id,
-           killmail.victim.faction_id}
-    return not bool(ids.intersection(guild.lists.get(filt.who_ignore)))
+    journal.rotate()
+    await save(config, wait=True)
+    journal.discard_rotated()
 
 
 @timeit
 @logger
-async def is_who_attacker(killmail: Killmail, guild: Guild, filt: Filter) -> bool:
-    """Check if an attacker is in the filters 'who' list.
+async def refresh_universe() -> bool:
+    """Rebuild the universe store from ESI, write it to file and recompile the filters of every guild.
 
-    :param killmail: The killmail.
-    :param guild: The guild.
-    :param filt: The filter.
-    :return: True if an attacker is in the filters 'who' list.
+    The store is only replaced when every region, constellation and solar system came back complete, a partial
+    store would make range and security status filters fail or match everything. The old store is kept otherwise.
+
+    :return: True if the store was replaced.
     """
-    ids = set()
-    for attacker in killmail.attackers:
-        ids.update([attacker.alliance_id,
-                    attacker.corporation_id,
-                    attacker.character_id,
-                    attacker.faction_id])
-    return bool(ids.intersection(guild.lists.get(filt.who)))
+    ids = {'regions': await esi_region_ids(), 'constellations': await esi_constellation_ids(),
+           'systems': await esi_system_ids()}
+    if not all(type(value) is list for value in ids.values()):
+        log.error('Failed to fetch the universe IDs from ESI, keeping the old universe store')
+        return False
+
+    regions = await fetch_complete(esi_regions, ids['regions'], keys=('region_id', 'name', 'constellations'))
+    constellations = await fetch_complete(esi_constellations, ids['constellations'],
+                                          keys=('constellation_id', 'name', 'region_id', 'systems'))
+    systems = await fetch_complete(esi_systems, ids['systems'],
+                                   keys=('system_id', 'name', 'constellation_id', 'security_status', 'position'))
+    fetched = {'regions': regions, 'constellations': constellations, 'systems': systems}
+    failed = {key: len(set(ids[key])) - len(fetched[key]) for key in ids}
+    if any(failed.values()):
+        log.error(f'Failed to fetch {", ".join(f"{count} {key}" for key, count in failed.items() if count)} from ESI, '
+                  f'keeping the old universe store')
+        return False
+
+    regions = {region_id: from_dict(cls=Region, dictionary=region) for region_id, region in regions.items()}
+    constellations = {constellation_id: from_dict(cls=Constellation, dictionary=constellation)
+                      for constellation_id, constellation in constellations.items()}
+    systems = {system_id: from_dict(cls=SolarSystem, dictionary=system) for system_id, system in systems.items()}
+    universe.replace(systems=systems, constellations=constellations, regions=regions)
+    await save_universe(universe)
 
+    for guild in config.guilds:
+        index.update(guild)
+    if pool is not None:
+        pool.set_universe(universe)
+    return True
 
-@timeit
-@logger
-async def is_who_ignore_attacker(killmail: Killmail, guild: Guild, filt: Filter) -> bool:
-    """Check if an attacker is in the 'who_ignore' list.
 
-    :param killmail: The killmail.
-    :param guild: The guild.
-    :param filt: The filter.
-    :return: True if an attacker is in the filters 'who_ignore' list.
+async def build_universe():
+    """Build the universe store from ESI when it is missing, like on the first start of a deployment.
+
+    :return: None.
     """
-    ids = set()
-    for attacker in killmail.attackers:
-        ids.update([
-            attacker.alliance_id,
-            attacker.corporation_id,
-            attacker.character_id,
-            attacker.faction_id
-        ])
-    return not bool(ids.intersection(guild.lists.get(filt.who_ignore)))
+    log.warning('The universe store is empty, building it from ESI')
+    try:
+        built = await refresh_universe()
+    except Exception as e:
+        log.error(f'Failed to build the universe store, run !refreshuniverse to try again: {e!r}')
+    else:
+        if built:
+            log.info(f'Built the universe store with {len(universe.systems)} systems')
+        else:
+            log.error('Failed to build the universe store, run !refreshuniverse to try again')
 
 
-@timeit
-@logger
-async def has_items(killmail: Killmail, guild: Guild, filt: Filter) -> bool:
-    """Check if an item is in the filters 'items' list.
+def update_guild(guild: Guild):
+    """Compile and index the filters of a guild again, in this process and in the matcher pool.
+
+    Must be called whenever the filters, lists or staging system of the guild change.
 
-    :param killmail: The killmail.
     :param guild: The guild.
-    :param filt: The filter.
-    :return: True if an item is in the filters 'items' list.
     """
-    matching = [item.item_type_id in guild.lists.get(filt.items) for item in killmail.victim.items]
-    return True in matching
-
+    index.update(guild)
+    if pool is not None:
+        pool.update(guild)
 
-@timeit
-@logger
-async def security_status_low(killmail: Killmail, filt: Filter) -> bool:
-    """Check if the solar systems security status is over the filters low limit.
 
-    :param killmail: The killmail.
-    :param filt: The filter.
-    :return: True if the solar systems security status is over the filters low limit.
-    """
-    solar_system = await esi_systems(killmail.solar_system_id)
-    security_status = float(solar_system.get('security_status'))
-    return security_status >= filt.lowest_security
+journal.replay(config)
+# Guilds move to another shard when the number of shards changes, so the journals of the other shards are replayed too.
+# Records for guilds of other shards are ignored.
+for _path in sorted(glob.glob('config/reported*.jsonl')):
+    if _path != journal.path:
+        Journal(path=_path).replay(config)
 
+pool = MatcherPool(processes=intel_config.getint('processes'), universe=universe) \
+    if intel_config.getint('processes') else None
 
-@timeit
-@logger
-async def security_status_high(killmail: Killmail, filt: Filter) -> bool:
-    """Check if the solar systems security status is under the filters high limit.
-
-    :param killmail: The killmail.
-    :param filt: The filter.
-    :return: True if the solar systems security status is under the filters high limit.
-    """
-    solar_system = await esi_systems(killmail.solar_system_id)
-    security_status = float(solar_system.get('security_status'))
-    return security_status <= filt.highest_security
+for _guild in config.guilds:
+    update_guild(_guild)
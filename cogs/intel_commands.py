@@ -5,7 +5,10 @@ from dataclasses import asdict
 from utils.fetch import (esi_ids, esi_names, esi_search, esi_regions, esi_constellations)
 from utils.dataclass import (from_dict, Guild, Filter)
 from utils.file import save
+from utils.idset import IdSet
+from utils.universe import expand_to_systems
 from utils.command import (args_to_kwargs, args_to_list, esi_ids_to_lists, esi_names_to_lists)
+from .intel import (update_guild, universe)
 from . import config
 
 
@@ -21,12 +24,12 @@ class IntelCog:
         await self.add_guild(guild)
 
     async def add_guild(self, guild: discord.Guild):
-        if not discord.utils.find(lambda g: g.id == guild.id, config.guilds):
+        if guild.id not in config.guilds:
             kwargs = {'id': guild.id,
                       'lists': {},
                       'filters': []}
             new_guild: Guild = from_dict(cls=Guild, dictionary=kwargs)
-            config.guilds.append(new_guild)
+            config.guilds.add(new_guild)
             await save(config)
             log.info(f'Joined new guild {guild.name}.')
         else:
@@ -44,7 +47,7 @@ class IntelCog:
 
         :param channel: The discord server to use.
         """
-        guild: Guild = discord.utils.find(lambda g: g.id == ctx.guild.id, config.guilds)
+        guild: Guild = config.guilds.get(ctx.guild.id)
 
         if channel:
             new_channel = channel.id
@@ -55,15 +58,13 @@ class IntelCog:
             new_channel_name = ctx.channel.name
             log.debug(f'Guild {guild.id} sets channel {ctx.channel.name}, {ctx.channel.id}')
 
-        config.guilds.remove(guild)
-        guild.channel = new_channel
-        config.guilds.append(guild)
+        config.guilds.update(guild.id, channel=new_channel)
         await save(config)
         await ctx.send(f'{new_channel_name} set as channel.')
 
     @commands.command(name='setstaging', aliases=['set_staging'])
     async def set_staging(self, ctx, system: str):
-        guild: Guild = discord.utils.find(lambda g: g.id == ctx.guild.id, config.guilds)
+        guild: Guild = config.guilds.get(ctx.guild.id)
 
         system_response = await esi_search(categories='solar_system', search=system)
         if system_response is None:
@@ -71,9 +72,8 @@ class IntelCog:
         elif len(system_response) > 1:
             await ctx.send(f'More than one result found, please be more specific.')
         else:
-            config.guilds.remove(guild)
-            guild.staging = system_response[0]
-            config.guilds.append(guild)
+            config.guilds.update(guild.id, staging=system_response[0])
+            update_guild(guild)
             await save(config)
             await ctx.send(f'{system} set as staging.')
 
@@ -86,9 +86,9 @@ class IntelCog:
     @filt.command(name='list', aliases=['l', 's', 'show'])
     async def filt_list(self, ctx):
         """List all filters for this server."""
-        guild: Guild = discord.utils.find(lambda g: g.id == ctx.guild.id, config.guilds)
+        guild: Guild = config.guilds.get(ctx.guild.id)
         msg = ''
-        for filt in guild.filters:
+        for filt in guild.filters.values():
             msg += '\n' + str(filt)
         await ctx.send(msg)
 
@@ -102,8 +102,8 @@ class IntelCog:
         kwargs = await args_to_kwargs(*args)
         kwargs['name'] = name
 
-        guild: Guild = discord.utils.find(lambda g: g.id == ctx.guild.id, config.guilds)
-        filt: Filter = discord.utils.find(lambda f: f.name == kwargs.get('name'), guild.filters)
+        guild: Guild = config.guilds.get(ctx.guild.id)
+        filt: Filter = guild.filters.get(name)
 
         valid_lists = [guild.lists.get(kwargs.get(element)) for element in ['what', 'where', 'who', 'who_ignore', 'items'] if kwargs.get(element)]
         if None in valid_lists:
@@ -113,14 +113,11 @@ class IntelCog:
         if filt:
             new_filter_dict = {**asdict(filt), **kwargs}
             new_filter = from_dict(cls=Filter, dictionary=new_filter_dict)
-            guild.filters.remove(filt)
-
         else:
             new_filter = from_dict(cls=Filter, dictionary=kwargs)
 
-        config.guilds.remove(guild)
-        guild.filters.append(new_filter)
-        config.guilds.append(guild)
+        config.guilds.set_filter(guild.id, new_filter)
+        update_guild(guild)
         await save(config)
         await ctx.send(f'{new_filter}')
 
@@ -130,12 +127,9 @@ class IntelCog:
 
         :param name: The name of the filer.
         """
-        guild: Guild = discord.utils.find(lambda g: g.id == ctx.guild.id, config.guilds)
-        filt: Filter = discord.utils.find(lambda f: f.name == name, guild.filters)
-        if filt is not None:
-            config.guilds.remove(guild)
-            guild.filters.remove(filt)
-            config.guilds.append(guild)
+        guild: Guild = config.guilds.get(ctx.guild.id)
+        if config.guilds.remove_filter(guild.id, name):
+            update_guild(guild)
             await save(config)
             await ctx.send(f'Filter {name} removed.')
             return
@@ -152,15 +146,15 @@ class IntelCog:
 
         :param name: Name of the list.
         """
-        guild: Guild = discord.utils.find(lambda g: g.id == ctx.guild.id, config.guilds)
+        guild: Guild = config.guilds.get(ctx.guild.id)
 
         if not name:
-            lists = [key for key in guild.lists.keys()]
+            lists = ', '.join(f'{key} ({len(ids)} IDs, {ids.nbytes / 1024:.1f} KiB)' for key, ids in guild.lists.items())
             await ctx.send(f'Lists: {lists}')
             return
 
         if guild.lists.get(name):
-            response = await esi_names(guild.lists.get(name))
+            response = await esi_names(list(guild.lists.get(name)))
             ids, names = await esi_names_to_lists(list(response))
             if len(str(names)) > 1800:
                 await ctx.send(f'List is too big to be sent as one message. Please make several lists instead.')
@@ -170,53 +164,37 @@ class IntelCog:
         else:
             await ctx.send(f'List {name} was not found.')
 
-    async def region_to_systems(self, args) -> tuple:
-        """Takes arguments from a "!list add region" command and returns ids and names of all systems in the regions.
-
-        :param args: Regions to get the systems from.
-        :return: A tuple with list of ids and list of names for all systems in the regions.
-        """
-        args.pop(0)
-        systems = []
-        for region in args:
-            search_response = await esi_search(categories='region', search=region)
-            region_response = await esi_regions(search_response[0])
-            for constellation in region_response.get('constellations'):
-                constellation_response = await esi_constellations(constellation)
-                systems += constellation_response.get('systems')
-
-        response = await esi_names(systems)
-        ids, names = await esi_names_to_lists(list(response))
-
-        return ids, names
-
     @_list.command(name='add', aliases=['edit', 'update', 'u', 'a', 'e'])
     async def list_add(self, ctx, name: str, *args):
         """Add or update a list.
 
         All items (args) must be separated with spaces. Names with spaces need to be in quotes (").
+        Start the items with region or constellation to add all solar systems in the regions or constellations.
 
         :param name: Name of the list.
         :param args: Items to add to the list.
         """
         args = await args_to_list(*args)
 
-        if args[0] in ['region', 'regions']:
-            ids, names = await self.region_to_systems(args)
+        if args[0] in ['region', 'regions', 'constellation', 'constellations']:
+            ids, names, not_found = await expand_to_systems(universe=universe, category=args[0].rstrip('s'),
+                                                            names=args[1:], search=esi_search, get_region=esi_regions,
+                                                            get_constellation=esi_constellations, get_names=esi_names)
+            if not_found:
+                await ctx.send(f'Could not find {", ".join(not_found)}.')
         else:
             response = await esi_ids(args)
             ids, names = await esi_ids_to_lists(response)
 
-        guild: Guild = discord.utils.find(lambda g: g.id == ctx.guild.id, config.guilds)
+        guild: Guild = config.guilds.get(ctx.guild.id)
 
         if guild.lists.get(name):
-            new_list = list(set(guild.lists.get(name)).union(ids))
+            new_list = guild.lists.get(name).union(ids)
         else:
-            new_list = ids
+            new_list = IdSet(ids)
 
-        config.guilds.remove(guild)
-        guild.lists[name] = new_list
-        config.guilds.append(guild)
+        config.guilds.set_list(guild.id, name, new_list)
+        update_guild(guild)
         await save(config)
 
         if len(str(names)) > 1800:
@@ -231,11 +209,9 @@ class IntelCog:
 
         :param name: Name of the list.
         """
-        guild: Guild = discord.utils.find(lambda g: g.id == ctx.guild.id, config.guilds)
-        if guild.lists.get(name):
-            config.guilds.remove(guild)
-            guild.lists.pop(name)
-            config.guilds.append(guild)
+        guild: Guild = config.guilds.get(ctx.guild.id)
+        if config.guilds.remove_list(guild.id, name):
+            update_guild(guild)
             await save(config)
 
             await ctx.send(f'List {name} removed.')
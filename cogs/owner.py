@@ -1,8 +1,13 @@
 import discord
 from discord.ext import commands
 import asyncio
+import io
 
 from utils.decorator import (timeit, logger)
+from utils.fetch import cache
+from utils.metrics import registry
+from utils.trace import tracer
+from .intel import (refresh_universe, universe, queue, pipeline, delivery)
 
 
 class OwnerCog:
@@ -37,6 +42,60 @@ class OwnerCog:
         """
         asyncio.create_task(self.cog_handler(ctx=ctx, extension=extension, command='reload'))
 
+    @commands.command(name='refreshuniverse', aliases=['refresh_universe'], hidden=True)
+    @commands.is_owner()
+    async def universe_refresh(self, ctx):
+        """Rebuild the local universe store from ESI."""
+        await ctx.send('Refreshing universe, this will take a while.')
+        if not await refresh_universe():
+            await ctx.send('Could not fetch the whole universe from ESI, kept the old universe store. See the log.')
+            return
+        await ctx.send(f'Universe refreshed with {len(universe.systems)} systems, '
+                       f'{len(universe.constellations)} constellations and {len(universe.regions)} regions.')
+
+    @commands.command(name='cache', hidden=True)
+    @commands.is_owner()
+    async def cache_stats(self, ctx):
+        """Show the ESI response cache statistics."""
+        stats = ', '.join(f'{key}: {value}' for key, value in cache.stats().items())
+        await ctx.send(f'Cache {stats}')
+
+    @commands.command(name='queue', hidden=True)
+    @commands.is_owner()
+    async def queue_stats(self, ctx):
+        """Show the killmail pipeline statistics."""
+        stats = ', '.join(f'{key}: {value}' for key, value in pipeline.items())
+        await ctx.send(f'Queue depth: {queue.qsize()}/{queue.maxsize}, {stats}, '
+                       f'delivery depth: {delivery.depth()} in {len(delivery.channels)} channels')
+
+    @commands.command(name='metrics', hidden=True)
+    @commands.is_owner()
+    async def metrics(self, ctx):
+        """Send the metrics in the Prometheus text format."""
+        text = registry.render().encode()
+        await ctx.send(file=discord.File(io.BytesIO(text), filename='metrics.txt'))
+
+    @commands.command(name='trace', hidden=True)
+    @commands.is_owner()
+    async def trace(self, ctx, name: str = None, rate: float = 1.0):
+        """Log the arguments and results of a function, for a fraction of the calls.
+
+        Without a name the traced functions are listed.
+        """
+        if name is None:
+            traced = ', '.join(f'{trace.name} ({trace.rate})' for trace in tracer.traces.values() if trace.enabled)
+            await ctx.send(f'Tracing: {traced or "nothing"}')
+            return
+        names = tracer.enable(name, rate=rate)
+        await ctx.send(f'Tracing {", ".join(names)} at rate {rate}' if names else f'No traceable function {name}')
+
+    @commands.command(name='untrace', hidden=True)
+    @commands.is_owner()
+    async def untrace(self, ctx, name: str):
+        """Stop tracing a function."""
+        names = tracer.disable(name)
+        await ctx.send(f'Stopped tracing {", ".join(names)}' if names else f'Not tracing {name}')
+
     @timeit
     @logger
     async def cog_handler(self, ctx, extension: str, command: str):
@@ -0,0 +1,81 @@
+"""Ingestion process for a sharded deployment.
+
+Reads killmails from a single source and fans them out over a Unix socket to every shard process,
+so the killmail feed is consumed once no matter how many shards there are.
+
+    python ingest.py [--source redisq] [--replay archive.jsonl.gz ...] [--speed 10] [--wait-for 2]
+
+The number of shards is taken from config/bot.ini or KVERNA_SHARD_COUNT, like for the shards. Every package is kept
+until every shard got it, so a shard that is down or restarting holds up the source instead of missing killmails.
+
+Every shard runs kverna.py with source=ipc in the intel section of config/bot.ini and
+KVERNA_SHARD_ID and KVERNA_SHARD_COUNT set in its environment. For a test on one machine without Discord,
+run the shards with replay.py --ipc instead, which stands in a collecting fake for the gateway.
+"""
+import argparse
+import asyncio
+import logging
+
+from cogs import (bot_config, websocket_session, shard_count)
+from utils.fetch import fetch
+from utils.ipc import FanOut
+from utils.source import (make_source, ReplaySource)
+
+
+log = logging.getLogger('discord')
+
+
+async def ingest(fan_out: FanOut, source, wait_for: int) -> int:
+    """Publish every package from the source to the shards.
+
+    :param fan_out: The fan-out server.
+    :param source: The killmail source.
+    :param wait_for: Number of shards to wait for before reading from the source.
+    :return: Number of packages published.
+    """
+    await fan_out.start()
+    if wait_for:
+        log.info(f'Waiting for {wait_for} shards')
+        await fan_out.wait_for(wait_for)
+
+    count = 0
+    async for package in source:
+        await fan_out.publish(package)
+        count += 1
+    await fan_out.close()
+    return count
+
+
+def main():
+    intel_config = bot_config['intel']
+    parser = argparse.ArgumentParser(description='Fan killmails out to the shard processes.')
+    parser.add_argument('--source', choices=['redisq', 'websocket'],
+                        help='the source to read from, defaults to the source in the config')
+    parser.add_argument('--replay', nargs='+', metavar='PATH', help='replay JSONL archives instead of a live source')
+    parser.add_argument('--speed', type=float, default=0, help='real-time factor for --replay, 0 is max speed')
+    parser.add_argument('--socket', default=intel_config['ipc_socket'], help='path of the Unix socket')
+    parser.add_argument('--wait-for', type=int, default=shard_count,
+                        help='number of shards to wait for before starting, defaults to every shard')
+    args = parser.parse_args()
+
+    logging.basicConfig(level=logging.INFO, format='%(asctime)s; %(name)s; %(levelname)s; %(message)s')
+    if args.replay:
+        source = ReplaySource(paths=args.replay, speed=args.speed)
+    else:
+        if args.source:
+            intel_config['source'] = args.source
+        if intel_config['source'] == 'ipc':
+            parser.error('the ingestion process needs a live source, use --source')
+        try:
+            source = make_source(source_config=intel_config, fetch=fetch, session=websocket_session)
+        except ValueError as e:
+            parser.error(str(e))
+
+    loop = asyncio.get_event_loop()
+    fan_out = FanOut(path=args.socket, shard_count=shard_count)
+    count = loop.run_until_complete(ingest(fan_out=fan_out, source=source, wait_for=args.wait_for))
+    print(f'Published {count} killmails.')
+
+
+if __name__ == '__main__':
+    main()
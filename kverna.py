@@ -1,9 +1,9 @@
 import discord
 from discord.ext import commands
+import atexit
 import configparser
 import logging.config
 import logging.handlers
-from cogs import intel
 
 bot_config = configparser.ConfigParser()
 bot_config.read('config/bot.ini')
@@ -11,19 +11,28 @@ bot_config.read('config/bot.ini')
 secret = configparser.ConfigParser()
 secret.read('config/secret.ini')
 
-logging.config.fileConfig('config/log.ini')
 log = logging.getLogger('discord')
 
-bot = commands.Bot(command_prefix=bot_config['default']['command_prefix'],
-                   description=bot_config['default']['description'])
-
 
 initial_extensions = ['cogs.owner',
                       'cogs.intel_commands',
                       'cogs.info']
 
 
-if __name__ == '__main__':
+def main():
+    logging.config.fileConfig('config/log.ini')
+
+    # The cogs are imported here, the matcher pool workers import this module again when they start.
+    from cogs import (intel, shard_id, shard_count)
+    from utils.file import saver
+    from utils.metrics import serve
+    from utils.trace import tracer
+
+    shard = {'shard_id': shard_id, 'shard_count': shard_count} if shard_count > 1 else {}
+    bot = commands.Bot(command_prefix=bot_config['default']['command_prefix'],
+                       description=bot_config['default']['description'],
+                       **shard)
+
     for extension in initial_extensions:
         try:
             bot.load_extension(extension)
@@ -32,11 +41,29 @@ if __name__ == '__main__':
         else:
             log.info(f'{extension} loaded successfully')
 
+    try:
+        source = intel.make_intel_source()
+    except ValueError as e:
+        log.error(f'Refusing to start: {e}')
+        return
 
-@bot.event
-async def on_ready():
-    log.info(f'Connected as {bot.user}.')
+    trace_config = bot_config['trace']
+    tracer.set_max_length(trace_config.getint('max_length'))
+    for name in filter(None, (name.strip() for name in trace_config['functions'].split(','))):
+        tracer.enable(name, rate=trace_config.getfloat('sample_rate'))
 
+    @bot.event
+    async def on_ready():
+        log.info(f'Connected as {bot.user}.')
 
-bot.loop.create_task(intel.listen(bot=bot))
-bot.run(secret['tokens']['discord_token'])
+    atexit.register(saver.flush_sync)
+
+    bot.loop.create_task(intel.listen(bot=bot, source=source))
+    if bot_config['metrics'].getboolean('enabled'):
+        bot.loop.create_task(serve(host=bot_config['metrics']['host'],
+                                   port=bot_config['metrics'].getint('port') + shard_id))
+    bot.run(secret['tokens']['discord_token'])
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,123 @@
+"""Replay archived killmails through the matcher, with the Discord output replaced by a collecting sink.
+
+    python replay.py archive.jsonl.gz [more.jsonl ...] [--speed 10] [--workers 4]
+    python replay.py --ipc kverna.sock
+
+With --ipc the killmails are read from a running ingest.py instead, which makes this a shard with a fake gateway.
+The shard is set with KVERNA_SHARD_ID and KVERNA_SHARD_COUNT, like for kverna.py.
+
+The config is loaded as usual, but reported killmails and config saves go to a temporary directory,
+so the live config and journal are left untouched.
+"""
+import argparse
+import asyncio
+import logging
+import os
+import tempfile
+import time
+
+from utils.journal import Journal
+from utils.source import (Source, ReplaySource, IPCSource)
+
+
+log = logging.getLogger('discord')
+
+
+class CollectingChannel:
+    """Stand-in for a Discord channel that keeps every message sent to it."""
+
+    def __init__(self, channel_id: int):
+        self.id = channel_id
+        self.messages = []
+
+    async def send(self, content: str = None, **kwargs):
+        self.messages.append(content)
+
+
+class CollectingBot:
+    """Stand-in for the Discord bot that hands out collecting channels."""
+
+    def __init__(self):
+        self.channels = {}
+
+    def get_channel(self, channel_id: int) -> CollectingChannel:
+        channel = self.channels.get(channel_id)
+        if channel is None:
+            channel = self.channels[channel_id] = CollectingChannel(channel_id)
+        return channel
+
+    @property
+    def posts(self) -> int:
+        return sum(len(channel.messages) for channel in self.channels.values())
+
+    @property
+    def matches(self) -> int:
+        return sum(len(message.splitlines()) for channel in self.channels.values() for message in channel.messages)
+
+
+async def replay(source: Source, workers: int) -> dict:
+    """Feed every killmail from the source through the pipeline.
+
+    :param source: The replay source.
+    :param workers: Number of evaluation workers.
+    :return: The results.
+    """
+    from cogs import intel
+
+    bot = CollectingBot()
+    tasks = [asyncio.ensure_future(intel.evaluate(bot=bot)) for _ in range(workers)]
+    start = time.perf_counter()
+    await intel.ingest(source=source)
+    await intel.queue.join()
+    await intel.delivery.join()
+    elapsed = time.perf_counter() - start
+    for task in tasks:
+        task.cancel()
+    intel.delivery.close()
+
+    killmails = intel.pipeline['processed']
+    return {'killmails': killmails,
+            'seconds': elapsed,
+            'killmails_per_second': killmails / elapsed if elapsed else 0,
+            'matches': bot.matches,
+            'posts': bot.posts,
+            'channels': len(bot.channels)}
+
+
+def main():
+    # The cogs are imported here, the matcher pool workers import this module again when they start.
+    from cogs import (intel, shard_id, shard_count)
+    from utils.file import saver
+
+    parser = argparse.ArgumentParser(description='Replay archived killmails through the matcher.')
+    parser.add_argument('paths', nargs='*', help='JSONL archives, optionally gzip compressed')
+    parser.add_argument('--ipc', metavar='SOCKET', help='read the killmails from ingest.py on this socket instead')
+    parser.add_argument('--speed', type=float, default=0,
+                        help='real-time factor, 1 replays as fast as the kills happened, 0 (default) is max speed')
+    parser.add_argument('--workers', type=int, default=intel.intel_config.getint('workers'),
+                        help='number of evaluation workers')
+    args = parser.parse_args()
+    if not args.paths and not args.ipc:
+        parser.error('give archives to replay or --ipc')
+
+    if args.ipc:
+        source = IPCSource(path=args.ipc, shard_id=shard_id, retry_delay=intel.intel_config.getfloat('retry_delay'),
+                           reconnect=False)
+    else:
+        source = ReplaySource(paths=args.paths, speed=args.speed)
+
+    directory = tempfile.mkdtemp(prefix='kverna-replay-')
+    intel.journal = Journal(path=os.path.join(directory, 'reported.jsonl'),
+                            compact_every=intel.journal.compact_every)
+    saver.path = os.path.join(directory, 'config.json')
+
+    loop = asyncio.get_event_loop()
+    results = loop.run_until_complete(replay(source=source, workers=args.workers))
+    print(f'Shard {shard_id}/{shard_count}: ' if shard_count > 1 else '', end='')
+    print(f'Replayed {results["killmails"]} killmails in {results["seconds"]:.2f} seconds '
+          f'({results["killmails_per_second"]:.1f} kills/sec), '
+          f'{results["matches"]} matches in {results["posts"]} posts to {results["channels"]} channels.')
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,76 @@
+import asyncio
+import time
+
+from utils.delivery import Delivery
+
+
+class ServerError(Exception):
+    status = 503
+
+
+class Forbidden(Exception):
+    status = 403
+
+
+class FakeChannel:
+    """Channel that records the posts sent to it and raises the queued errors first."""
+
+    def __init__(self, channel_id: int = 1, errors: list = ()):
+        self.id = channel_id
+        self.errors = list(errors)
+        self.posts = []
+        self.times = []
+
+    async def send(self, content: str):
+        if self.errors:
+            raise self.errors.pop(0)
+        self.posts.append(content)
+        self.times.append(time.perf_counter())
+
+
+def deliver(channel: FakeChannel, contents: list, **settings) -> list:
+    """Submit messages to the channel and wait until they are delivered.
+
+    :return: A list of what the done callback was called with for every message.
+    """
+    results = []
+
+    async def run():
+        delivery = Delivery(**{'window': 0.01, 'rate': 1000, 'burst': 1000, 'retry_delay': 0.01, **settings})
+        for number, content in enumerate(contents):
+            async def done(sent: bool, number=number):
+                results.append((number, sent))
+            delivery.submit(channel=channel, content=content, done=done)
+        await asyncio.wait_for(delivery.join(), timeout=10)
+        delivery.close()
+
+    asyncio.run(run())
+    return results
+
+
+def test_messages_are_coalesced_into_posts():
+    channel = FakeChannel()
+    results = deliver(channel, [f'kill {number}' for number in range(10)], max_length=30)
+    assert channel.posts == ['kill 0\nkill 1\nkill 2\nkill 3', 'kill 4\nkill 5\nkill 6\nkill 7', 'kill 8\nkill 9']
+    assert results == [(number, True) for number in range(10)]
+
+
+def test_posts_are_rate_limited():
+    channel = FakeChannel()
+    deliver(channel, ['x' * 10] * 4, max_length=10, rate=20, burst=1)
+    assert len(channel.posts) == 4
+    assert all(later - earlier >= 0.04 for earlier, later in zip(channel.times, channel.times[1:]))
+
+
+def test_failed_posts_are_tried_again_without_losing_messages():
+    channel = FakeChannel(errors=[ServerError(), ServerError()])
+    results = deliver(channel, [f'kill {number}' for number in range(4)], max_length=13)
+    assert channel.posts == ['kill 0\nkill 1', 'kill 2\nkill 3']
+    assert results == [(number, True) for number in range(4)]
+
+
+def test_posts_failing_with_client_errors_are_dropped():
+    channel = FakeChannel(errors=[Forbidden()])
+    results = deliver(channel, ['kill 0', 'kill 1'], max_length=6)
+    assert channel.posts == ['kill 1']
+    assert results == [(0, False), (1, True)]
@@ -0,0 +1,37 @@
+import asyncio
+import json
+
+from utils.file import (load, write, Saver)
+from utils.idset import IdSet
+
+
+def test_lists_survive_a_load_and_save_round_trip(tmp_path):
+    path = str(tmp_path / 'config.json')
+    lists = {'small': [30000142, 30000144], 'region': list(range(30004700, 30004800)),
+             'large': list(range(90000000, 90020000, 2))}
+    write(path, {'guilds': [{'id': 1, 'channel': 2, 'staging': None, 'lists': lists, 'filters': [],
+                             'reported_killmail_id': {}, 'reported_count': 0, 'active_systems': {},
+                             'ignored_systems': {}}]})
+
+    async def round_trip():
+        config = await load(path)
+        await Saver(path=path, delay=0).save(config, wait=True)
+        return config
+
+    config = asyncio.run(round_trip())
+    with open(path) as file:
+        stored = json.load(file)['guilds'][0]['lists']
+    assert stored['small'] == lists['small']
+    assert stored['region'] == {'deltas': [30004700] + [1] * 99}
+    assert stored['large']['deltas'][1:] == [2] * 9999
+
+    reloaded = asyncio.run(load(path))
+    guild = next(iter(reloaded.guilds))
+    for name, ids in lists.items():
+        assert guild.lists[name] == IdSet(ids) == next(iter(config.guilds)).lists[name]
+        assert sorted(guild.lists[name]) == ids
+
+
+def test_equal_sets_hash_equal():
+    assert hash(IdSet([3, 1, 2])) == hash(IdSet([1, 2, 3]))
+    assert len({IdSet(range(20000)), IdSet(range(20000)), IdSet([1])}) == 2
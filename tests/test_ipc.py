@@ -0,0 +1,44 @@
+import asyncio
+
+from utils.ipc import FanOut
+from utils.source import IPCSource
+
+
+async def take(packages, count: int) -> list:
+    return [(await packages.__anext__())['killID'] for _ in range(count)]
+
+
+def test_shards_get_every_package_across_reconnects(tmp_path):
+    path = str(tmp_path / 'kverna.sock')
+
+    async def run():
+        fan_out = FanOut(path=path, shard_count=2, max_buffer=2000)
+        await fan_out.start()
+        first = IPCSource(path=path, shard_id=0, retry_delay=0.01)
+        second = IPCSource(path=path, shard_id=1, retry_delay=0.01)
+        first_packages = first.packages()
+
+        async def publish():
+            for kill_id in range(1, 101):
+                await fan_out.publish({'killID': kill_id, 'zkb': {}})
+
+        publisher = asyncio.ensure_future(publish())
+        received = await take(first_packages, 10)
+
+        # the first shard drops its connection and the second one has not connected yet
+        await first_packages.aclose()
+        await asyncio.sleep(0.05)
+        assert not publisher.done()
+
+        first_packages = first.packages()
+        second_packages = second.packages()
+        rest, others = await asyncio.gather(take(first_packages, 90), take(second_packages, 100))
+        assert received + rest == list(range(1, 101))
+        assert others == list(range(1, 101))
+
+        await publisher
+        await fan_out.close()
+        await first_packages.aclose()
+        await second_packages.aclose()
+
+    asyncio.run(asyncio.wait_for(run(), timeout=10))
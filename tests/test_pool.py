@@ -0,0 +1,42 @@
+import asyncio
+import os
+import signal
+
+from utils.dataclass import (from_dict, Guild, Killmail, Zkb)
+from utils.pool import MatcherPool
+from utils.universe import Universe
+
+
+def make_guild(guild_id: int) -> Guild:
+    return from_dict(cls=Guild, dictionary={
+        'id': guild_id, 'channel': 1, 'staging': None, 'lists': {'systems': [30000142]},
+        'filters': [{'name': 'jita', 'action': 'kill', 'where': 'systems', 'enabled': True}],
+        'reported_killmail_id': {}, 'reported_count': 0, 'active_systems': {}, 'ignored_systems': {}})
+
+
+def test_dead_workers_are_replaced_with_their_guilds():
+    killmail_data = {'killmail_id': 1, 'killmail_time': '2018-10-18T12:00:00Z', 'solar_system_id': 30000142,
+                     'attackers': [], 'victim': {'character_id': 1, 'ship_type_id': 670, 'items': []}}
+    killmail = from_dict(cls=Killmail, dictionary=killmail_data)
+    zkb = from_dict(cls=Zkb, dictionary={'totalValue': 10000, 'npc': False, 'solo': False, 'awox': False})
+
+    async def run():
+        pool = MatcherPool(processes=2, universe=Universe())
+        try:
+            for guild_id in (10, 11):
+                pool.update(make_guild(guild_id))
+            before = await pool.match(zkb=zkb, killmail=killmail, killmail_data=killmail_data)
+
+            broken = pool.executors[1]
+            for process in list(broken._processes.values()):
+                os.kill(process.pid, signal.SIGKILL)
+            await asyncio.sleep(0.5)
+            after = await pool.match(zkb=zkb, killmail=killmail, killmail_data=killmail_data)
+            return before, after, pool.executors[1] is not broken
+        finally:
+            pool.shutdown()
+
+    before, after, replaced = asyncio.run(asyncio.wait_for(run(), timeout=30))
+    assert sorted(candidate.guild.id for candidate in before) == [10, 11]
+    assert sorted(candidate.guild.id for candidate in after) == [10, 11]
+    assert replaced
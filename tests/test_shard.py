@@ -0,0 +1,62 @@
+import asyncio
+import json
+
+from utils.dataclass import (Filter, Guild)
+from utils.dedup import ReportedKillmails
+from utils.file import (load, write, Saver)
+from utils.ipc import shard_of
+
+
+def make_guild(guild_id: int) -> dict:
+    return {'id': guild_id, 'channel': guild_id + 1, 'staging': None, 'lists': {'systems': [30000142]},
+            'filters': [{'name': 'jita', 'action': 'kill', 'where': 'systems', 'enabled': True}],
+            'reported_killmail_id': {}, 'reported_count': 0, 'active_systems': {}, 'ignored_systems': {}}
+
+
+def run_shards(path: str, shard_count: int, edit) -> None:
+    """Load every shard of the config, let edit change it and save it like a running shard would."""
+    async def run():
+        for shard_id in range(shard_count):
+            config = await load(path, shard=(shard_id, shard_count))
+            assert all(shard_of(guild.id, shard_count) == shard_id for guild in config.guilds)
+            edit(shard_id, config)
+            saver = Saver(path=path, delay=0, shard=(shard_id, shard_count))
+            await saver.save(config, wait=True)
+
+    asyncio.run(run())
+
+
+def test_reshard_keeps_every_guild(tmp_path):
+    path = str(tmp_path / 'config.json')
+    guild_ids = [(number << 22) + number for number in range(1, 31)]
+    write(path, {'guilds': [make_guild(guild_id) for guild_id in guild_ids]})
+
+    def edit(shard_id: int, config):
+        # every shard adds a guild and a filter to one of its guilds, like the commands do
+        guild = next(iter(config.guilds))
+        config.guilds.set_filter(guild.id, Filter(name=f'shard{shard_id}', action='kill', what=None, where=None,
+                                                  who=None, who_ignore=None, range=None, ping=False, isk_value=None,
+                                                  items=None, lowest_security=None, highest_security=None,
+                                                  enabled=True))
+        new_id = (1000 + shard_id) << 22
+        while shard_of(new_id, 2) != shard_id:
+            new_id += 1 << 22
+        config.guilds.add(Guild(id=new_id, channel=1, staging=None, lists={}, filters={},
+                                reported_killmail_id=ReportedKillmails(), reported_count=0, active_systems={},
+                                ignored_systems={}))
+        guild_ids.append(new_id)
+
+    run_shards(path, shard_count=2, edit=edit)
+    run_shards(path, shard_count=3, edit=lambda shard_id, config: None)
+
+    loaded = {shard_id: asyncio.run(load(path, shard=(shard_id, 3))) for shard_id in range(3)}
+    assert sorted(guild.id for config in loaded.values() for guild in config.guilds) == sorted(guild_ids)
+
+    with open(path) as file:
+        stored = json.load(file)
+    assert sorted(guild['id'] for guild in stored['guilds']) == sorted(guild_ids)
+    filters = {filt['name'] for guild in stored['guilds'] for filt in guild['filters']}
+    assert {'jita', 'shard0', 'shard1'} <= filters
+
+    unsharded = asyncio.run(load(path))
+    assert len(unsharded.guilds) == len(guild_ids)
@@ -0,0 +1,52 @@
+import asyncio
+import json
+
+import aiohttp
+from aiohttp import web
+from aiohttp.test_utils import TestServer
+
+from utils.source import WebSocketSource
+
+
+def killmail(killmail_id: int) -> str:
+    return json.dumps({'killmail_id': killmail_id, 'zkb': {'hash': 'abc'}})
+
+
+def test_websocket_source_skips_malformed_messages_and_reconnects():
+    subscriptions = []
+
+    async def killstream(request):
+        websocket = web.WebSocketResponse()
+        await websocket.prepare(request)
+        subscriptions.append(await websocket.receive_json())
+        if len(subscriptions) == 1:
+            await websocket.send_str('{not json')
+            await websocket.send_str('[1, 2]')
+            await websocket.send_str(json.dumps({'action': 'tqStatus'}))
+            await websocket.send_str(killmail(1))
+            await websocket.send_str(killmail(2))
+            # the stream drops, the source has to reconnect and subscribe again
+            await websocket.close()
+        else:
+            await websocket.send_str(killmail(3))
+            await asyncio.sleep(1)
+        return websocket
+
+    async def run():
+        app = web.Application()
+        app.router.add_get('/websocket/', killstream)
+        server = TestServer(app)
+        await server.start_server()
+        async with aiohttp.ClientSession() as session:
+            source = WebSocketSource(session=session, url=str(server.make_url('/websocket/')), channel='killstream',
+                                     retry_delay=0.01)
+            packages = source.packages()
+            received = [await packages.__anext__() for _ in range(3)]
+            await packages.aclose()
+        await server.close()
+        return received
+
+    received = asyncio.run(asyncio.wait_for(run(), timeout=10))
+    assert [package['killID'] for package in received] == [1, 2, 3]
+    assert received[0]['zkb'] == {'hash': 'abc'}
+    assert subscriptions == [{'action': 'sub', 'channel': 'killstream'}] * 2
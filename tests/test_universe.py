@@ -0,0 +1,45 @@
+import asyncio
+
+from utils import universe as universe_module
+from utils.universe import (Universe, expand_to_systems)
+
+
+async def search(categories: str, search: str) -> list:
+    return {'Delve': [10], 'Querious': [11]}.get(search)
+
+
+async def get_constellation(constellation_id: int) -> dict:
+    return {'constellation_id': constellation_id, 'name': f'C{constellation_id}', 'region_id': 10,
+            'systems': [constellation_id * 10, constellation_id * 10 + 1]}
+
+
+async def get_names(ids: list) -> list:
+    return [{'id': _id, 'name': f'S{_id}'} for _id in ids]
+
+
+def test_regions_that_fail_to_fetch_are_skipped_and_not_saved(monkeypatch):
+    requests = []
+    saved = []
+
+    async def save_universe(universe: Universe):
+        saved.append(universe)
+
+    monkeypatch.setattr(universe_module, 'save_universe', save_universe)
+
+    async def get_region(region_id: int) -> dict:
+        requests.append(region_id)
+        if region_id == 11 or len(requests) == 1:
+            return {'error': 'Timeout contacting tranquility'}
+        return {'region_id': region_id, 'name': 'Delve', 'constellations': [20, 21]}
+
+    universe = Universe()
+    ids, names, not_found = asyncio.run(expand_to_systems(universe=universe, category='region',
+                                                          names=['Delve', 'Querious', 'Nowhere'], search=search,
+                                                          get_region=get_region, get_constellation=get_constellation,
+                                                          get_names=get_names))
+    assert ids == [200, 201, 210, 211]
+    assert names == ['S200', 'S201', 'S210', 'S211']
+    assert not_found == ['Querious', 'Nowhere']
+    assert sorted(requests) == [10, 10, 11, 11]
+    assert universe.find('region', 'delve') == 10
+    assert saved == []
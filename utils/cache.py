@@ -0,0 +1,159 @@
+import sys
+import time
+from collections import OrderedDict
+from email.utils import parsedate_to_datetime
+from urllib.parse import urlsplit
+
+
+class CacheEntry:
+    """A cached response."""
+    __slots__ = ('value', 'etag', 'expires', 'size')
+
+    def __init__(self, value, etag: str, expires: float, size: int):
+        self.value = value
+        self.etag = etag
+        self.expires = expires
+        self.size = size
+
+    def is_fresh(self) -> bool:
+        return time.time() < self.expires
+
+
+def size_of(value) -> int:
+    """Estimate the memory used by a decoded response, counting the containers and everything in them.
+
+    :param value: The decoded response.
+    :return: The size in bytes.
+    """
+    size = 0
+    stack = [value]
+    while stack:
+        value = stack.pop()
+        size += sys.getsizeof(value)
+        if isinstance(value, dict):
+            stack.extend(value.keys())
+            stack.extend(value.values())
+        elif isinstance(value, (list, tuple)):
+            stack.extend(value)
+    return size
+
+
+class ResponseCache:
+    """Bounded LRU cache for ESI responses.
+
+    Entries are fresh until the Expires header of the response, unless the endpoint has its own TTL configured.
+    Stale entries are kept so they can be revalidated with their ETag. Entries are evicted least recently used
+    first when the estimated memory used by the decoded responses goes over max_bytes.
+
+    All operations are synchronous, so they are never interleaved by the event loop.
+    """
+
+    def __init__(self, max_bytes: int, default_ttl: float, ttls: dict = None, hosts: list = None):
+        self.max_bytes = max_bytes
+        self.default_ttl = default_ttl
+        self.ttls = ttls or {}
+        self.hosts = hosts or ['esi.evetech.net']
+        self.entries = OrderedDict()
+        self.size = 0
+        self.hits = 0
+        self.misses = 0
+        self.revalidations = 0
+        self.evictions = 0
+
+    @staticmethod
+    def key(url: str, params: dict = None, raw: bool = False) -> tuple:
+        return url, tuple(sorted(params.items())) if params else (), raw
+
+    def endpoint(self, url: str) -> [str, None]:
+        """Get the endpoint name of an url, the first path segment after the version.
+
+        :param url: The url.
+        :return: The endpoint name, or None if responses from this host are not cached.
+        """
+        parts = urlsplit(url)
+        if parts.hostname not in self.hosts:
+            return None
+        segments = [segment for segment in parts.path.split('/') if segment]
+        if len(segments) > 1 and (segments[0] in ['latest', 'dev', 'legacy'] or segments[0].startswith('v')):
+            segments.pop(0)
+        return segments[0] if segments else ''
+
+    def is_cacheable(self, url: str) -> bool:
+        endpoint = self.endpoint(url)
+        return endpoint is not None and self.ttls.get(endpoint, self.default_ttl) > 0
+
+    def get(self, key: tuple) -> [CacheEntry, None]:
+        """Get an entry, fresh or stale, and mark it as recently used.
+
+        :param key: The cache key.
+        :return: The entry or None.
+        """
+        entry = self.entries.get(key)
+        if entry is None:
+            self.misses += 1
+            return None
+        self.entries.move_to_end(key)
+        if entry.is_fresh():
+            self.hits += 1
+        else:
+            self.misses += 1
+        return entry
+
+    def put(self, key: tuple, value, headers) -> None:
+        """Add or replace an entry.
+
+        :param key: The cache key.
+        :param value: The decoded response.
+        :param headers: The response headers.
+        """
+        size = size_of(value)
+        if size > self.max_bytes:
+            return
+        old = self.entries.pop(key, None)
+        if old is not None:
+            self.size -= old.size
+        self.entries[key] = CacheEntry(value=value, etag=headers.get('ETag'),
+                                       expires=self.expires(url=key[0], headers=headers), size=size)
+        self.size += size
+        while self.size > self.max_bytes:
+            _, evicted = self.entries.popitem(last=False)
+            self.size -= evicted.size
+            self.evictions += 1
+
+    def revalidated(self, key: tuple, headers) -> None:
+        """Refresh the expiry of an entry after the server answered 304 Not Modified.
+
+        :param key: The cache key.
+        :param headers: The response headers.
+        """
+        entry = self.entries.get(key)
+        if entry is not None:
+            entry.expires = self.expires(url=key[0], headers=headers)
+            self.revalidations += 1
+
+    def expires(self, url: str, headers) -> float:
+        """Work out when a response expires.
+
+        :param url: The url of the request.
+        :param headers: The response headers.
+        :return: The expiry as a unix timestamp.
+        """
+        endpoint = self.endpoint(url)
+        if endpoint in self.ttls:
+            return time.time() + self.ttls[endpoint]
+        expires = headers.get('Expires')
+        if expires:
+            try:
+                return parsedate_to_datetime(expires).timestamp()
+            except (TypeError, ValueError):
+                pass
+        return time.time() + self.default_ttl
+
+    def stats(self) -> dict:
+        return {'entries': len(self.entries),
+                'bytes': self.size,
+                'max_bytes': self.max_bytes,
+                'hits': self.hits,
+                'misses': self.misses,
+                'revalidations': self.revalidations,
+                'evictions': self.evictions}
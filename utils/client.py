@@ -0,0 +1,120 @@
+import asyncio
+import logging
+from contextlib import asynccontextmanager
+from urllib.parse import urlsplit
+
+import aiohttp
+
+
+log = logging.getLogger('discord')
+
+
+def make_session(headers: dict, limit_per_host: int, timeout: [float, None], keepalive_timeout: float,
+                 dns_cache_ttl: int, loop=None, connect_timeout: float = None) -> aiohttp.ClientSession:
+    """Make a session with its own connection pool.
+
+    :param headers: Headers to send with every request.
+    :param limit_per_host: Max number of simultaneous connections to one host.
+    :param timeout: Total timeout for a request in seconds, None for long-lived connections like WebSockets.
+    :param keepalive_timeout: Seconds to keep idle connections open.
+    :param dns_cache_ttl: Seconds to cache DNS lookups.
+    :param loop: The event loop.
+    :param connect_timeout: Timeout for opening a connection in seconds.
+    :return: The session.
+    """
+    connector = aiohttp.TCPConnector(limit_per_host=limit_per_host,
+                                     keepalive_timeout=keepalive_timeout,
+                                     ttl_dns_cache=dns_cache_ttl,
+                                     loop=loop)
+    return aiohttp.ClientSession(headers=headers,
+                                 connector=connector,
+                                 timeout=aiohttp.ClientTimeout(total=timeout, sock_connect=connect_timeout),
+                                 loop=loop)
+
+
+class TokenBucket:
+    """Token bucket rate limiter that slows down as the ESI error limit runs out.
+
+    Waiting callers are served in the order they arrived.
+    """
+
+    def __init__(self, rate: float, burst: int, error_threshold: int):
+        self.rate = rate
+        self.burst = burst
+        self.error_threshold = error_threshold
+        self.current_rate = rate
+        self.tokens = burst
+        self.updated = None
+        self.paused_until = 0
+        self.lock = asyncio.Lock()
+
+    async def acquire(self):
+        """Wait for a token."""
+        async with self.lock:
+            loop = asyncio.get_event_loop()
+            while True:
+                now = loop.time()
+                if now < self.paused_until:
+                    await asyncio.sleep(self.paused_until - now)
+                    continue
+                if self.updated is not None:
+                    self.tokens = min(self.burst, self.tokens + (now - self.updated) * self.current_rate)
+                self.updated = now
+                if self.tokens >= 1:
+                    self.tokens -= 1
+                    return
+                await asyncio.sleep((1 - self.tokens) / self.current_rate)
+
+    def update(self, remain: int, reset: int):
+        """Adjust the rate to what is left of the error limit.
+
+        The rate is scaled down with the remaining errors, and requests are paused until the
+        error window resets when the remaining errors go under the threshold.
+
+        :param remain: Errors remaining in the current window.
+        :param reset: Seconds until the error window resets.
+        """
+        self.current_rate = self.rate * max(remain / 100, 0.05)
+        if remain <= self.error_threshold:
+            log.warning(f'ESI error limit at {remain}, pausing requests for {reset} seconds')
+            self.paused_until = asyncio.get_event_loop().time() + reset
+
+
+class Client:
+    """HTTP client with one connection pool per service and a rate limiter per limited host."""
+
+    def __init__(self, default: aiohttp.ClientSession, sessions: dict, limiters: dict):
+        """
+        :param default: The session used for hosts without a session of their own.
+        :param sessions: Sessions by host.
+        :param limiters: Token buckets by host.
+        """
+        self.default = default
+        self.sessions = sessions
+        self.limiters = limiters
+
+    @asynccontextmanager
+    async def request(self, method: str, url: str, **kwargs):
+        """Make a request through the pool and rate limiter for the host of the url.
+
+        :param method: The HTTP method to use for the request.
+        :param url: The url.
+        :param kwargs: Passed on to the session.
+        :return: The response.
+        """
+        host = urlsplit(url).hostname
+        limiter = self.limiters.get(host)
+        if limiter is not None:
+            await limiter.acquire()
+
+        async with self.sessions.get(host, self.default).request(method=method, url=url, **kwargs) as response:
+            remain = response.headers.get('X-ESI-Error-Limit-Remain')
+            reset = response.headers.get('X-ESI-Error-Limit-Reset')
+            if limiter is not None and remain is not None and reset is not None:
+                limiter.update(remain=int(remain), reset=int(reset))
+            yield response
+
+    async def close(self):
+        await self.default.close()
+        for session in self.sessions.values():
+            await session.close()
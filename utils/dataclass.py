@@ -1,6 +1,10 @@
-from dataclasses import (dataclass, fields)
+from dataclasses import (dataclass, fields, asdict)
 from math import sqrt
 
+from utils.decoder import decodable
+from utils.dedup import ReportedKillmails
+from utils.idset import IdSet
+
 
 def from_dict(cls: dataclass, dictionary: dict):
     """Make dataclass object from a dictionary.
@@ -44,8 +48,11 @@ def from_dict(cls: dataclass, dictionary: dict):
     return cls(**init_kwargs)
 
 
+@decodable()
 @dataclass
 class Attacker:
+    __slots__ = ('alliance_id', 'character_id', 'corporation_id', 'damage_done', 'faction_id', 'final_blow',
+                 'security_status', 'ship_type_id', 'weapon_type_id')
     alliance_id: int
     character_id: int
     corporation_id: int
@@ -57,8 +64,22 @@ class Attacker:
     weapon_type_id: int
 
 
+@decodable()
+@dataclass
+class Item:
+    __slots__ = ('flag', 'item_type_id', 'quantity_destroyed', 'quantity_dropped', 'singleton')
+    flag: int
+    item_type_id: int
+    quantity_destroyed: int
+    quantity_dropped: int
+    singleton: int
+
+
+@decodable(items=Item)
 @dataclass
 class Victim:
+    __slots__ = ('alliance_id', 'character_id', 'corporation_id', 'damage_taken', 'faction_id', 'items',
+                 'position', 'ship_type_id')
     alliance_id: int
     character_id: int
     corporation_id: int
@@ -72,8 +93,10 @@ class Victim:
         self.items = [from_dict(cls=Item, dictionary=item) for item in self.items]
 
 
+@decodable(attackers=Attacker, victim=Victim)
 @dataclass
 class Killmail:
+    __slots__ = ('attackers', 'killmail_id', 'killmail_time', 'moon_id', 'solar_system_id', 'victim', 'war_id')
     attackers: list
     killmail_id: int
     killmail_time: str
@@ -87,17 +110,10 @@ class Killmail:
         self.victim = from_dict(cls=Victim, dictionary=self.victim)
 
 
-@dataclass
-class Item:
-    flag: int
-    item_type_id: int
-    quantity_destroyed: int
-    quantity_dropped: int
-    singleton: int
-
-
+@decodable()
 @dataclass
 class Zkb:
+    __slots__ = ('locationID', 'hash', 'fittedValue', 'totalValue', 'points', 'npc', 'solo', 'awox', 'href')
     locationID: int
     hash: str
     fittedValue: int
@@ -114,7 +130,11 @@ class Config:
     guilds: list
 
     def __post_init__(self):
-        self.guilds = [from_dict(cls=Guild, dictionary=guild) for guild in self.guilds]
+        self.guilds = GuildRegistry([guild if isinstance(guild, Guild) else from_dict(cls=Guild, dictionary=guild)
+                                     for guild in self.guilds])
+
+    def to_json(self) -> dict:
+        return {'guilds': self.guilds.snapshot()}
 
 
 @dataclass
@@ -123,13 +143,140 @@ class Guild:
     channel: int
     staging: int
     lists: dict
-    filters: list
-    reported_killmail_id: dict
+    filters: dict
+    reported_killmail_id: ReportedKillmails or dict
+    reported_count: int
     active_systems: dict
     ignored_systems: dict
 
     def __post_init__(self):
-        self.filters = [from_dict(cls=Filter, dictionary=filt) for filt in self.filters]
+        filters = self.filters.values() if isinstance(self.filters, dict) else self.filters
+        self.filters = {}
+        for filt in filters:
+            filt = filt if isinstance(filt, Filter) else from_dict(cls=Filter, dictionary=filt)
+            self.filters[filt.name] = filt
+        self.lists = {name: ids if isinstance(ids, IdSet) else IdSet.from_json(ids)
+                      for name, ids in self.lists.items()}
+        if not isinstance(self.reported_killmail_id, ReportedKillmails):
+            if self.reported_count is None:
+                self.reported_count = len(self.reported_killmail_id or {})
+            self.reported_killmail_id = ReportedKillmails.from_json(self.reported_killmail_id)
+
+    def to_json(self) -> dict:
+        """Serialize the guild in the shape it is stored in the config file, with the filters as a list.
+
+        :return: The guild as a dictionary.
+        """
+        data = asdict(self)
+        data['filters'] = list(data['filters'].values())
+        return data
+
+
+class GuildRegistry:
+    """The guilds of the config keyed by ID.
+
+    Every change to a guild goes through the registry, which marks only that guild dirty. Saving copies the dirty
+    guilds and reuses the copies of the others from the previous save.
+    Iterating the registry gives the guilds.
+    """
+
+    def __init__(self, guilds: list = ()):
+        self.guilds = {guild.id: guild for guild in guilds}
+        self.dirty = set(self.guilds)
+        self.snapshots = {}
+
+    def __iter__(self):
+        return iter(self.guilds.values())
+
+    def __len__(self) -> int:
+        return len(self.guilds)
+
+    def __contains__(self, guild_id: int) -> bool:
+        return guild_id in self.guilds
+
+    def get(self, guild_id: int):
+        return self.guilds.get(guild_id)
+
+    def add(self, guild: 'Guild'):
+        self.guilds[guild.id] = guild
+        self.dirty.add(guild.id)
+
+    def remove(self, guild_id: int):
+        self.guilds.pop(guild_id, None)
+        self.snapshots.pop(guild_id, None)
+        self.dirty.discard(guild_id)
+
+    def update(self, guild_id: int, **values):
+        """Set fields of a guild.
+
+        :param guild_id: The guild ID.
+        :param values: New values by field name.
+        """
+        guild = self.guilds[guild_id]
+        for name, value in values.items():
+            setattr(guild, name, value)
+        self.dirty.add(guild_id)
+
+    def set_filter(self, guild_id: int, filt: 'Filter'):
+        self.guilds[guild_id].filters[filt.name] = filt
+        self.dirty.add(guild_id)
+
+    def remove_filter(self, guild_id: int, name: str) -> bool:
+        """Remove a filter from a guild.
+
+        :param guild_id: The guild ID.
+        :param name: Name of the filter.
+        :return: True if the filter was removed, False if there was no such filter.
+        """
+        if self.guilds[guild_id].filters.pop(name, None) is None:
+            return False
+        self.dirty.add(guild_id)
+        return True
+
+    def set_list(self, guild_id: int, name: str, ids):
+        self.guilds[guild_id].lists[name] = ids
+        self.dirty.add(guild_id)
+
+    def remove_list(self, guild_id: int, name: str) -> bool:
+        """Remove a list from a guild.
+
+        :param guild_id: The guild ID.
+        :param name: Name of the list.
+        :return: True if the list was removed, False if there was no such list.
+        """
+        if self.guilds[guild_id].lists.pop(name, None) is None:
+            return False
+        self.dirty.add(guild_id)
+        return True
+
+    def add_reported(self, guild_id: int, killmail_id: int, time: str) -> bool:
+        """Add a killmail reported to a guild.
+
+        :param guild_id: The guild ID.
+        :param killmail_id: The killmail ID.
+        :param time: When the killmail was reported, in ISO 8601 format.
+        :return: True if the killmail was not reported to the guild before.
+        """
+        guild = self.guilds.get(guild_id)
+        if guild is None or not guild.reported_killmail_id.add(killmail_id, time):
+            return False
+        guild.reported_count += 1
+        self.dirty.add(guild_id)
+        return True
+
+    def snapshot(self) -> list:
+        """Copy the guilds in the shape they are stored in the config file.
+
+        Only the guilds that changed since the previous snapshot are copied again.
+
+        :return: A list of guilds as dictionaries.
+        """
+        for guild_id in self.dirty:
+            guild = self.guilds.get(guild_id)
+            if guild is not None:
+                self.snapshots[guild_id] = guild.to_json()
+        self.dirty = set()
+        return [self.snapshots[guild_id] for guild_id in self.guilds]
 
 
 @dataclass
@@ -167,3 +314,31 @@ class Position:
     def distance_in_light_years(self, other):
         light_year = 9.4607 * 10 ** 15
         return abs(self - other) / light_year
+
+
+@dataclass
+class SolarSystem:
+    system_id: int
+    name: str
+    constellation_id: int
+    security_status: float
+    position: Position or dict
+
+    def __post_init__(self):
+        if type(self.position) is dict:
+            self.position = from_dict(cls=Position, dictionary=self.position)
+
+
+@dataclass
+class Constellation:
+    constellation_id: int
+    name: str
+    region_id: int
+    systems: list
+
+
+@dataclass
+class Region:
+    region_id: int
+    name: str
+    constellations: list
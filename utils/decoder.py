@@ -0,0 +1,117 @@
+import json
+from collections.abc import Sequence
+from dataclasses import fields
+
+
+NULLS = frozenset(['none', 'null'])
+
+
+class LazyList(Sequence):
+    """List of nested dataclasses that are only decoded the first time the list is used.
+
+    The JSON is still parsed in full up front, only building the dataclasses is deferred.
+    """
+    __slots__ = ('raw', 'decoder', 'skip', 'items')
+
+    def __init__(self, raw: list, decoder, skip: frozenset):
+        self.raw = raw
+        self.decoder = decoder
+        self.skip = skip
+        self.items = None
+
+    def materialize(self) -> list:
+        if self.items is None:
+            decoder = self.decoder
+            skip = self.skip
+            self.items = [decoder(element, skip) for element in self.raw]
+            self.raw = None
+        return self.items
+
+    def __getitem__(self, index):
+        return self.materialize()[index]
+
+    def __iter__(self):
+        return iter(self.materialize())
+
+    def __len__(self) -> int:
+        return len(self.raw) if self.items is None else len(self.items)
+
+    def __eq__(self, other) -> bool:
+        if not isinstance(other, Sequence):
+            return NotImplemented
+        return self.materialize() == list(other)
+
+    def __repr__(self) -> str:
+        return repr(self.materialize())
+
+
+def to_bool(value) -> bool:
+    if type(value) is bool:
+        return value
+    if type(value) is str:
+        if value.lower() == 'false':
+            return False
+        if value.lower() == 'true':
+            return True
+    return value
+
+
+def decodable(**nested):
+    """Class decorator that generates a specialized decoder for a dataclass when the class is defined.
+
+    The decoder converts a dictionary to the dataclass with the same rules as from_dict, but without looking the
+    fields up and branching on their types for every object. Nested dataclasses are decoded directly, without
+    going through __init__ and __post_init__. Lists of nested dataclasses are decoded lazily, and nested fields
+    named in skip are left empty without being decoded at all.
+
+    :param nested: Field names mapped to the dataclass of the field, for fields holding a dataclass or a list of them.
+    :return: The class decorator.
+    """
+    def decorate(cls):
+        namespace = {'cls': cls, 'new': object.__new__, 'NULLS': NULLS, 'to_bool': to_bool, 'LazyList': LazyList}
+        lines = ['def decoder(dictionary, skip=frozenset()):',
+                 '    get = dictionary.get',
+                 '    obj = new(cls)']
+        for _field in fields(cls):
+            name = _field.name
+            lines.append(f'    value = get({name!r})')
+            lines.append('    if value.__class__ is str and value.lower() in NULLS: value = None')
+            if name in nested:
+                namespace[f'decode_{name}'] = nested[name].decoder
+                if _field.type is list:
+                    lines.append(f'    if {name!r} in skip: obj.{name} = ()')
+                    lines.append(f'    else: obj.{name} = LazyList(value, decode_{name}, skip) '
+                                 f'if value is not None else []')
+                else:
+                    lines.append(f'    obj.{name} = decode_{name}(value, skip) if value is not None else None')
+            elif _field.type is list:
+                lines.append(f'    obj.{name} = value if value is not None else []')
+            elif _field.type is dict:
+                lines.append(f'    obj.{name} = value if value is not None else {{}}')
+            elif _field.type in [int, float]:
+                namespace[_field.type.__name__] = _field.type
+                lines.append(f'    obj.{name} = {_field.type.__name__}(value) if value is not None else None')
+            elif _field.type is bool:
+                lines.append(f'    obj.{name} = to_bool(value) if value is not None else None')
+            else:
+                lines.append(f'    obj.{name} = value')
+        lines.append('    return obj')
+        exec('\n'.join(lines), namespace)
+        cls.decoder = staticmethod(namespace['decoder'])
+        return cls
+    return decorate
+
+
+def decode(cls, data, skip: frozenset = frozenset()):
+    """Decode a dataclass straight from a response body or an already parsed dictionary.
+
+    A body is always parsed in full with json.loads, skipped and lazy fields only save building the dataclasses.
+
+    :param cls: A dataclass decorated with decodable.
+    :param data: The response body as bytes or str, or a dictionary.
+    :param skip: Names of nested list fields to leave empty, because nothing will ever use them.
+    :return: The dataclass object.
+    """
+    if type(data) is not dict:
+        data = json.loads(data)
+    return cls.decoder(data, skip)
@@ -1,56 +1,46 @@
-import logging
 import functools
 import inspect
-import datetime
+from time import perf_counter
 
-
-log = logging.getLogger("discord")
+from utils.metrics import registry
+from utils.trace import tracer
 
 
 def logger(func):
-    """Decorator to log function name and arguments when called, and log it's result.
+    """Decorator to make a function traceable with utils.trace.
+
+    The function is returned untouched, arguments and results are only logged while tracing it is enabled.
 
     :param func: The function to decorate.
-    :return: The wrapped function.
+    :return: The function.
     """
-    if inspect.iscoroutinefunction(func):
-        @functools.wraps(func)
-        async def wrapped(*args, **kwargs):
-            log.debug(f'{func.__name__} called with args {args}, kwargs {kwargs}')
-            result = await func(*args, **kwargs)
-            log.debug(f'{func.__name__} returns {result}')
-            return result
-    else:
-        @functools.wraps(func)
-        def wrapped(*args, **kwargs):
-            log.debug(f'{func.__name__} called with args {args}, kwargs {kwargs}')
-            result = func(*args, **kwargs)
-            log.debug(f'{func.__name__} returns {result}')
-            return result
-    return wrapped
+    return tracer.register(func)
 
 
 def timeit(func):
-    """Decorator to log function name execution time.
+    """Decorator to record the execution time of a function in the function_seconds histogram.
 
     :param func: The function to decorate.
     :return: The wrapped function.
     """
+    histogram = registry.histogram('kverna_function_seconds', 'Execution time of timed functions.',
+                                   labels={'function': func.__qualname__})
+    observe = histogram.observe
+
     if inspect.iscoroutinefunction(func):
+        @functools.wraps(func)
         async def wrapped(*args, **kwargs):
-            start_time = datetime.datetime.now()
-            result = await func(*args, **kwargs)
-            end_time = datetime.datetime.now()
-            delta = end_time - start_time
-            log.debug(f'{func.__name__} executed in {delta.total_seconds() * 1000:.2f} milliseconds')
-            return result
+            start_time = perf_counter()
+            try:
+                return await func(*args, **kwargs)
+            finally:
+                observe(perf_counter() - start_time)
     else:
         @functools.wraps(func)
         def wrapped(*args, **kwargs):
-            start_time = datetime.datetime.now()
-            result = func(*args, **kwargs)
-            end_time = datetime.datetime.now()
-            delta = end_time - start_time
-            log.debug(f'{func.__name__} executed in {delta.total_seconds() * 1000:.2f} milliseconds')
-            return result
+            start_time = perf_counter()
+            try:
+                return func(*args, **kwargs)
+            finally:
+                observe(perf_counter() - start_time)
     return wrapped
@@ -0,0 +1,76 @@
+import datetime
+from collections import OrderedDict
+
+
+class ReportedKillmails:
+    """Killmail IDs reported to a guild within the retention window.
+
+    IDs are kept in one bucket per day, and whole buckets are dropped once they are older than the retention window,
+    since RedisQ never delivers killmails that old again. Membership checks are a single dict lookup.
+    """
+    retention_days = 7
+
+    def __init__(self):
+        self.ids = {}
+        self.buckets = OrderedDict()
+
+    @classmethod
+    def from_json(cls, reported: dict):
+        """Make the structure from the reported killmails stored in the config.
+
+        :param reported: Killmail IDs mapped to the time they were reported.
+        :return: The structure, with expired killmails left out.
+        """
+        new = cls()
+        for killmail_id, time in sorted((reported or {}).items(), key=lambda item: item[1]):
+            new.add(int(killmail_id), time)
+        return new
+
+    def to_json(self) -> dict:
+        return dict(self.ids)
+
+    @staticmethod
+    def day(time: str) -> int:
+        return datetime.date.fromisoformat(time[:10]).toordinal()
+
+    def add(self, killmail_id: int, time: str) -> bool:
+        """Add a reported killmail.
+
+        :param killmail_id: The killmail ID.
+        :param time: When the killmail was reported, in ISO 8601 format.
+        :return: True if the killmail was added, False if it was already reported or is outside the retention window.
+        """
+        if killmail_id in self.ids:
+            return False
+        day = self.day(time)
+        if self.buckets and day <= next(reversed(self.buckets)) - self.retention_days:
+            # already outside the retention window, so it is not kept and does not count as newly reported
+            return False
+        bucket = self.buckets.get(day)
+        if bucket is None:
+            newest = next(reversed(self.buckets)) if self.buckets else day
+            bucket = self.buckets[day] = set()
+            if day < newest:
+                self.buckets = OrderedDict(sorted(self.buckets.items()))
+            self.expire(newest=max(day, newest))
+        bucket.add(killmail_id)
+        self.ids[killmail_id] = time
+        return True
+
+    def expire(self, newest: int):
+        """Drop the buckets that are older than the retention window.
+
+        :param newest: The newest day.
+        """
+        while self.buckets:
+            day = next(iter(self.buckets))
+            if day > newest - self.retention_days:
+                break
+            for killmail_id in self.buckets.pop(day):
+                del self.ids[killmail_id]
+
+    def __contains__(self, killmail_id: int) -> bool:
+        return killmail_id in self.ids
+
+    def __len__(self) -> int:
+        return len(self.ids)
@@ -0,0 +1,182 @@
+import asyncio
+import logging
+import time
+from time import perf_counter
+
+from utils.client import TokenBucket
+from utils.metrics import (registry, LAG_BUCKETS)
+
+
+log = logging.getLogger('discord')
+
+
+class ChannelQueue:
+    """Messages waiting to be posted to one channel, and the rate limiter for that channel.
+
+    Messages taken off the queue that could not be posted yet are kept in unsent, and posted before the queue.
+    """
+    __slots__ = ('channel', 'queue', 'unsent', 'bucket', 'retry_delay', 'task')
+
+    def __init__(self, channel, bucket: TokenBucket, retry_delay: float):
+        self.channel = channel
+        self.queue = asyncio.Queue()
+        self.unsent = []
+        self.bucket = bucket
+        self.retry_delay = retry_delay
+        self.task = None
+
+
+def is_permanent(error: Exception) -> bool:
+    """Check if posting failed in a way that will not go away by trying again, like missing permissions.
+
+    :param error: The error raised by the channel.
+    :return: True for client errors other than rate limits.
+    """
+    status = getattr(error, 'status', None)
+    return type(status) is int and 400 <= status < 500 and status != 429
+
+
+class Delivery:
+    """Post messages to Discord channels without holding up the caller.
+
+    Every channel has its own queue and worker. Messages that arrive within the window are coalesced into as few
+    posts as fit in the Discord message length, and posts to a channel are limited by a token bucket sized to the
+    Discord per-channel message bucket.
+    A post that fails is tried again with exponential backoff, keeping the messages after it in order, so a Discord
+    outage delays messages instead of losing them. Posts that fail with a client error, like missing permissions
+    for the channel, are dropped.
+    Anything with an async send(content) method and an id can be used as a channel.
+    """
+
+    def __init__(self, window: float, rate: float, burst: int, max_length: int = 2000, retry_delay: float = 1,
+                 max_retry_delay: float = 60):
+        """
+        :param window: Seconds to wait for more messages after the first one before posting.
+        :param rate: Posts per second allowed to a single channel.
+        :param burst: Posts allowed in a burst to a single channel.
+        :param max_length: Max characters in a single post.
+        :param retry_delay: Seconds to wait before posting again after a failure, doubled for every failed attempt.
+        :param max_retry_delay: Max seconds to wait before posting again.
+        """
+        self.window = window
+        self.rate = rate
+        self.burst = burst
+        self.max_length = max_length
+        self.retry_delay = retry_delay
+        self.max_retry_delay = max_retry_delay
+        self.channels = {}
+
+        registry.gauge('kverna_delivery_queue_depth', 'Messages waiting to be posted.', self.depth)
+        self.metrics = {
+            'delivery': registry.histogram('kverna_delivery_seconds', 'Seconds from a match to its post.'),
+            'send': registry.histogram('kverna_discord_send_seconds', 'Time spent posting to Discord.'),
+            'lag': registry.histogram('kverna_report_lag_seconds', 'Seconds from the kill happening to the post.',
+                                      buckets=LAG_BUCKETS),
+            'posts': registry.counter('kverna_discord_posts_total', 'Posts sent to Discord.'),
+            'errors': registry.counter('kverna_discord_errors_total', 'Posts that failed.'),
+            'dropped': registry.counter('kverna_discord_dropped_total', 'Messages dropped after a client error.')}
+
+    def depth(self) -> int:
+        return sum(channel_queue.queue.qsize() + len(channel_queue.unsent) for channel_queue in self.channels.values())
+
+    def submit(self, channel, content: str, since: float = None, done=None) -> bool:
+        """Queue a message for a channel.
+
+        :param channel: The channel.
+        :param content: The message.
+        :param since: Unix time of the event the message is about, used for the lag metric.
+        :param done: Coroutine function called with True once the message is posted, or False if it is dropped.
+        :return: False if the message was dropped right away because the channel is missing.
+        """
+        if channel is None:
+            log.warning(f'Dropping message for a missing channel: {content}')
+            return False
+        channel_queue = self.channels.get(channel.id)
+        if channel_queue is None:
+            channel_queue = self.channels[channel.id] = ChannelQueue(
+                channel=channel, bucket=TokenBucket(rate=self.rate, burst=self.burst, error_threshold=0),
+                retry_delay=self.retry_delay)
+            channel_queue.task = asyncio.ensure_future(self.deliver(channel_queue))
+        channel_queue.channel = channel
+        channel_queue.queue.put_nowait((content, perf_counter(), since, done))
+        return True
+
+    def posts(self, messages: list) -> list:
+        """Join messages into as few posts as possible.
+
+        :param messages: The queued messages.
+        :return: A list of tuples of a post and the messages in it.
+        """
+        posts = []
+        for message in messages:
+            content = message[0][:self.max_length]
+            if posts and len(posts[-1][0]) + 1 + len(content) <= self.max_length:
+                post, joined = posts[-1]
+                posts[-1] = (f'{post}\n{content}', joined + [message])
+            else:
+                posts.append((content, [message]))
+        return posts
+
+    async def deliver(self, channel_queue: ChannelQueue):
+        queue = channel_queue.queue
+        while True:
+            if not channel_queue.unsent:
+                channel_queue.unsent.append(await queue.get())
+                await asyncio.sleep(self.window)
+            while not queue.empty():
+                channel_queue.unsent.append(queue.get_nowait())
+            posts = self.posts(channel_queue.unsent)
+
+            for number, (post, messages) in enumerate(posts):
+                await channel_queue.bucket.acquire()
+                start_time = perf_counter()
+                try:
+                    await channel_queue.channel.send(post)
+                except Exception as e:
+                    self.metrics['errors'].inc()
+                    if not is_permanent(e):
+                        log.warning(f'Failed to post to channel {channel_queue.channel.id}, '
+                                    f'trying again in {channel_queue.retry_delay} seconds: {e!r}')
+                        channel_queue.unsent = [message for _, unsent in posts[number:] for message in unsent]
+                        await asyncio.sleep(channel_queue.retry_delay)
+                        channel_queue.retry_delay = min(channel_queue.retry_delay * 2, self.max_retry_delay)
+                        break
+                    log.error(f'Dropping post to channel {channel_queue.channel.id}: {e!r}')
+                    self.metrics['dropped'].inc(len(messages))
+                    await self.finish(channel_queue, messages, sent=False)
+                else:
+                    self.metrics['send'].observe(perf_counter() - start_time)
+                    self.metrics['posts'].inc()
+                    channel_queue.retry_delay = self.retry_delay
+                    await self.finish(channel_queue, messages, sent=True)
+            else:
+                channel_queue.unsent = []
+
+    async def finish(self, channel_queue: ChannelQueue, messages: list, sent: bool):
+        """Record the delivery of posted messages, call their done callbacks and mark them done in the queue.
+
+        :param channel_queue: The queue of the channel.
+        :param messages: The messages.
+        :param sent: True if the messages were posted, False if they were dropped.
+        """
+        now, wall = perf_counter(), time.time()
+        for _, submitted, since, done in messages:
+            if sent:
+                self.metrics['delivery'].observe(now - submitted)
+                if since is not None:
+                    self.metrics['lag'].observe(wall - since)
+            if done is not None:
+                try:
+                    await done(sent)
+                except Exception as e:
+                    log.error(f'Failed to finish delivery of a message: {e!r}')
+            channel_queue.queue.task_done()
+
+    async def join(self):
+        """Wait until every queued message has been posted or dropped."""
+        await asyncio.gather(*[channel_queue.queue.join() for channel_queue in self.channels.values()])
+
+    def close(self):
+        """Stop the channel workers, messages still queued are dropped."""
+        for channel_queue in self.channels.values():
+            channel_queue.task.cancel()
@@ -1,28 +1,152 @@
 import logging
+import asyncio
+import json
+import configparser
+import aiohttp
+from time import perf_counter
+from urllib.parse import urlsplit
 from utils.decorator import (logger, timeit)
-from cogs import session
+from utils.cache import ResponseCache
+from utils.metrics import registry
+from cogs import client
 
 
 log = logging.getLogger("discord")
 
+bot_config = configparser.ConfigParser()
+bot_config.read('config/bot.ini')
+
 esi_params = {'datasource': 'tranquility', 'language': 'en-us'}
+# Max number of items in one request to the bulk endpoints.
+ESI_IDS_CHUNK = 500
+ESI_NAMES_CHUNK = 1000
+
+cache_config = bot_config['cache']
+cache = ResponseCache(max_bytes=cache_config.getint('max_bytes'),
+                      default_ttl=cache_config.getfloat('default_ttl'),
+                      ttls={key: cache_config.getfloat(key)
+                            for key in cache_config if key not in ['max_bytes', 'default_ttl']})
+
+in_flight = {}
+counters = {'requests': registry.counter('kverna_http_requests_total', 'Outbound HTTP requests.'),
+            'coalesced': registry.counter('kverna_http_coalesced_total',
+                                          'Requests that shared an identical in-flight request.')}
+request_histograms = {}
+
+for _name in ['entries', 'bytes']:
+    registry.gauge(f'kverna_cache_{_name}', f'ESI response cache {_name}.', lambda name=_name: cache.stats()[name])
+for _name in ['hits', 'misses', 'revalidations', 'evictions']:
+    registry.counter(f'kverna_cache_{_name}_total', f'ESI response cache {_name}.',
+                     func=lambda name=_name: cache.stats()[name])
+
+
+def request_histogram(url: str):
+    """Get the histogram for requests to the endpoint of an url.
+
+    The histogram of every endpoint is made once and kept, so timing a request does not go through the registry.
+
+    :param url: The url.
+    :return: The histogram.
+    """
+    endpoint = cache.endpoint(url) or urlsplit(url).hostname
+    histogram = request_histograms.get(endpoint)
+    if histogram is None:
+        histogram = request_histograms[endpoint] = registry.histogram(
+            'kverna_http_request_seconds', 'Time spent on HTTP requests, by endpoint.', labels={'endpoint': endpoint})
+    return histogram
 
 
 @timeit
 @logger
-async def fetch(url: str, params: dict = None, data = None, method: str = 'GET') -> [dict, str, None]:
+async def fetch(url: str, params: dict = None, data = None, method: str = 'GET',
+                raw: bool = False) -> [dict, str, bytes, None]:
     """Make a request with the provided method, url and parameters and return the content
 
+    Concurrent calls with the same method, url, parameters and data share a single request.
+
     :param url: The url to request data from.
     :param params: A dictionary of key value pairs to be sent as parameters.
     :param method: The HTTP method to use for the request.
+    :param raw: Return the response body as bytes instead of decoding it.
+    :return: The contents of the response.
+    """
+    key = (method, url, tuple(sorted(params.items())) if params else (), data, raw)
+    task = in_flight.get(key)
+    if task is None:
+        task = asyncio.ensure_future(request(url=url, params=params, data=data, method=method, raw=raw))
+        in_flight[key] = task
+        task.add_done_callback(lambda _: in_flight.pop(key, None))
+    else:
+        counters['coalesced'].inc()
+    # shield the shared request so a cancelled caller does not cancel it for everyone else
+    return await asyncio.shield(task)
+
+
+async def request(url: str, params: dict = None, data = None, method: str = 'GET',
+                  raw: bool = False) -> [dict, str, bytes, None]:
+    """Make a request for fetch, without coalescing it with concurrent calls.
+
+    GET requests to ESI are served from the response cache while fresh, and revalidated with their ETag when stale.
+
+    :param url: The url to request data from.
+    :param params: A dictionary of key value pairs to be sent as parameters.
+    :param method: The HTTP method to use for the request.
+    :param raw: Return the response body as bytes instead of decoding it.
+    :return: The contents of the response.
+    """
+    if method != 'GET' or not cache.is_cacheable(url):
+        status, content = await send(url=url, params=params, data=data, method=method, raw=raw)
+        return content
+
+    key = cache.key(url=url, params=params, raw=raw)
+    entry = cache.get(key)
+    if entry is not None and entry.is_fresh():
+        return entry.value
+
+    headers = {'If-None-Match': entry.etag} if entry is not None and entry.etag else None
+    counters['requests'].inc()
+    start_time = perf_counter()
+    async with client.request(method=method, url=url, params=params, headers=headers) as response:
+        body = await response.read()
+    request_histogram(url).observe(perf_counter() - start_time)
+
+    if response.status == 304 and entry is not None:
+        cache.revalidated(key=key, headers=response.headers)
+        return entry.value
+    content = body if raw else decode(response, body)
+    if response.status == 200:
+        cache.put(key=key, value=content, headers=response.headers)
+    return content
+
+
+async def send(url: str, params: dict = None, data = None, method: str = 'GET', raw: bool = False) -> tuple:
+    """Make a request without coalescing or caching it.
+
+    :param url: The url to request data from.
+    :param params: A dictionary of key value pairs to be sent as parameters.
+    :param method: The HTTP method to use for the request.
+    :param raw: Return the response body as bytes instead of decoding it.
+    :return: A tuple with the status and the contents of the response.
+    """
+    counters['requests'].inc()
+    start_time = perf_counter()
+    async with client.request(method=method, url=url, params=params, data=data) as response:
+        body = await response.read()
+    request_histogram(url).observe(perf_counter() - start_time)
+    return response.status, body if raw else decode(response, body)
+
+
+def decode(response, body: bytes) -> [dict, str, None]:
+    """Decode a response body as JSON or text depending on the content type.
+
+    :param response: The response.
+    :param body: The response body.
     :return: The contents of the response.
     """
-    async with session.request(method=method, url=url, params=params, data=data) as response:
-        if response.content_type == 'application/json':
-            return await response.json()
-        else:
-            return await response.text()
+    if response.content_type == 'application/json':
+        return json.loads(body) if body.strip() else None
+    else:
+        return body.decode(response.charset or 'utf-8')
 
 
 @timeit
@@ -81,6 +205,42 @@ async def esi_systems(system_id: int) -> dict:
     return response
 
 
+@timeit
+@logger
+async def esi_region_ids() -> list:
+    """Get a list of all region IDs.
+
+    :return: A list of region IDs.
+    """
+    url = 'https://esi.evetech.net/latest/universe/regions/'
+    response = await fetch(url=url, params=esi_params)
+    return response
+
+
+@timeit
+@logger
+async def esi_constellation_ids() -> list:
+    """Get a list of all constellation IDs.
+
+    :return: A list of constellation IDs.
+    """
+    url = 'https://esi.evetech.net/latest/universe/constellations/'
+    response = await fetch(url=url, params=esi_params)
+    return response
+
+
+@timeit
+@logger
+async def esi_system_ids() -> list:
+    """Get a list of all solar system IDs.
+
+    :return: A list of solar system IDs.
+    """
+    url = 'https://esi.evetech.net/latest/universe/systems/'
+    response = await fetch(url=url, params=esi_params)
+    return response
+
+
 @timeit
 @logger
 async def esi_types(type_id: int) -> dict:
@@ -94,6 +254,61 @@ async def esi_types(type_id: int) -> dict:
     return response
 
 
+async def resolve_in_chunks(url: str, items: list, chunk_size: int, expected: type,
+                            limit: int = 5, retries: int = 2, retry_delay: float = 1) -> list:
+    """POST a list to a bulk ESI endpoint in chunks of at most the endpoint maximum.
+
+    The items are de-duplicated and the chunks are resolved concurrently, with at most limit requests in flight.
+    Chunks that fail with a server error, a timeout or an unexpected response are retried with exponential backoff,
+    the chunks that succeeded are not requested again. Chunks rejected with a client error, like an invalid ID, fail
+    the same way every time and are not retried.
+
+    :param url: The url of the endpoint.
+    :param items: The items to resolve.
+    :param chunk_size: Max number of items in one request.
+    :param expected: The type of a successful response.
+    :param limit: Max number of concurrent requests.
+    :param retries: Number of times to retry the chunks that failed with a server error or a timeout.
+    :param retry_delay: Seconds to wait before the first retry, doubled for every retry after it.
+    :return: A list with the responses of the chunks that succeeded.
+    """
+    items = list(dict.fromkeys(items))
+    chunks = [items[start:start + chunk_size] for start in range(0, len(items), chunk_size)]
+    results = [None] * len(chunks)
+    rejected = set()
+    semaphore = asyncio.Semaphore(limit)
+
+    async def resolve(index: int):
+        async with semaphore:
+            try:
+                status, response = await send(url=url, params=esi_params, data=json.dumps(chunks[index]),
+                                              method='POST')
+            except (aiohttp.ClientError, asyncio.TimeoutError) as e:
+                log.warning(f'Chunk {index + 1}/{len(chunks)} to {url} failed: {e!r}')
+                return
+            if 400 <= status < 500:
+                log.error(f'Chunk {index + 1}/{len(chunks)} to {url} was rejected with {status}: {response}')
+                rejected.add(index)
+            elif status >= 500:
+                log.warning(f'Chunk {index + 1}/{len(chunks)} to {url} failed with {status}: {response}')
+            elif isinstance(response, expected):
+                results[index] = response
+            else:
+                log.warning(f'Chunk {index + 1}/{len(chunks)} to {url} got an unexpected response: {response}')
+
+    pending = range(len(chunks))
+    for attempt in range(retries + 1):
+        if attempt:
+            await asyncio.sleep(retry_delay * 2 ** (attempt - 1))
+        await asyncio.gather(*[resolve(index) for index in pending])
+        pending = [index for index, result in enumerate(results) if result is None and index not in rejected]
+        if not pending:
+            break
+    if pending:
+        log.error(f'Gave up on {len(pending)} of {len(chunks)} chunks to {url}')
+    return [result for result in results if result is not None]
+
+
 @timeit
 @logger
 async def esi_ids(names: list) -> dict:
@@ -108,14 +323,16 @@ async def esi_ids(names: list) -> dict:
     :return: ID/name associations for a set of names divided by category.
     """
     url = f'https://esi.evetech.net/latest/universe/ids/'
-    data = str(names).replace('\'', '"')
-    response = await fetch(url=url, params=esi_params, data=data, method='POST')
+    response = {}
+    for chunk in await resolve_in_chunks(url=url, items=names, chunk_size=ESI_IDS_CHUNK, expected=dict):
+        for category, elements in chunk.items():
+            response.setdefault(category, []).extend(elements)
     return response
 
 
 @timeit
 @logger
-async def esi_names(ids: list) -> dict:
+async def esi_names(ids: list) -> list:
     """Resolve a set of IDs to names and categories.
 
     Supported ID’s for resolving are: Characters, Corporations,
@@ -125,6 +342,6 @@ async def esi_names(ids: list) -> dict:
     :return: ID/name associations for a set of ID’s.
     """
     url = f'https://esi.evetech.net/latest/universe/names/'
-    data = str(ids).replace('\'', '"')
-    response = await fetch(url=url, params=esi_params, data=data, method='POST')
-    return response
+    chunks = await resolve_in_chunks(url=url, items=[int(_id) for _id in ids], chunk_size=ESI_NAMES_CHUNK,
+                                     expected=list)
+    return [element for chunk in chunks for element in chunk]
@@ -1,25 +1,183 @@
+import asyncio
+import fcntl
 import json
+import logging
+import os
+import tempfile
 import aiofiles
-from dataclasses import asdict
 
 from utils.dataclass import (Config, from_dict)
 from utils.decorator import (logger, timeit)
+from utils.ipc import shard_of
 
 
+log = logging.getLogger('discord')
+
 CONFIG_FILE = 'config/config.json'
 
 
 @timeit
 @logger
-async def load() -> Config:
-    async with aiofiles.open(file=CONFIG_FILE, mode='r') as file:
+async def load(path: str = CONFIG_FILE, shard: tuple = None) -> Config:
+    """Load the config.
+
+    :param path: Path to the config file.
+    :param shard: Tuple of shard ID and number of shards, to only load the guilds of that shard.
+    :return: The config.
+    """
+    async with aiofiles.open(file=path, mode='r') as file:
         data = await file.read()
         config = json.loads(data)
+        if shard is not None:
+            shard_id, shard_count = shard
+            config['guilds'] = [guild for guild in config.get('guilds', [])
+                                if shard_of(guild.get('id'), shard_count) == shard_id]
         return from_dict(cls=Config, dictionary=config)
 
 
+def encode(obj):
+    """Encode objects that json does not know how to serialize.
+
+    :param obj: The object.
+    :return: A serializable representation of the object.
+    """
+    if hasattr(obj, 'to_json'):
+        return obj.to_json()
+    raise TypeError(f'Object of type {type(obj).__name__} is not JSON serializable')
+
+
+def write(path: str, snapshot: dict, indent: [int, None] = 4) -> None:
+    """Serialize a config snapshot and write it atomically.
+
+    The snapshot is written to a temporary file in the same directory, synced to disk and renamed over the old file,
+    so the file is never left half written. Every writer gets a temporary file of its own, so processes writing the
+    same file at the same time do not replace each other's half written files.
+
+    :param path: Path to the config file.
+    :param snapshot: The config as a dictionary.
+    :param indent: Indentation of the JSON, None for the most compact form.
+    """
+    data = json.dumps(obj=snapshot, indent=indent, default=encode)
+    directory = os.path.dirname(path) or '.'
+    fd, temp_path = tempfile.mkstemp(dir=directory, prefix=f'.{os.path.basename(path)}.', suffix='.tmp')
+    try:
+        with os.fdopen(fd, mode='w') as file:
+            file.write(data)
+            file.flush()
+            os.fsync(file.fileno())
+        os.replace(temp_path, path)
+    except BaseException:
+        os.remove(temp_path)
+        raise
+
+
+def write_shard(path: str, snapshot: dict, shard_id: int, shard_count: int) -> None:
+    """Write the guilds of one shard back into the config file, keeping the guilds of the other shards.
+
+    The config file is locked while it is read and replaced, so shards saving at the same time keep each other's
+    changes, and the file always holds every guild no matter how many shards there are.
+
+    :param path: Path to the config file.
+    :param snapshot: The config of the shard as a dictionary.
+    :param shard_id: The shard ID.
+    :param shard_count: Number of shards.
+    """
+    with open(f'{path}.lock', mode='a') as lock:
+        fcntl.flock(lock, fcntl.LOCK_EX)
+        stored = {}
+        if os.path.exists(path):
+            with open(path, mode='r') as file:
+                stored = json.load(file)
+        guilds = [guild for guild in stored.get('guilds', []) if shard_of(guild.get('id'), shard_count) != shard_id]
+        write(path, {**stored, **snapshot, 'guilds': guilds + snapshot.get('guilds', [])})
+
+
+class Saver:
+    """Write-behind saver for the config.
+
+    Saving marks the config dirty, and it is flushed at most once every delay seconds. The guilds that changed are
+    copied on the event loop, and the config is serialized and written in a worker thread.
+    With a shard set, only the guilds of that shard are written back into the config file.
+    A flush that fails is tried again with exponential backoff, the config stays dirty until it is written.
+    """
+
+    def __init__(self, path: str = CONFIG_FILE, delay: float = 1.0, shard: tuple = None,
+                 max_retry_delay: float = 60):
+        self.path = path
+        self.delay = delay
+        self.shard = shard
+        self.max_retry_delay = max_retry_delay
+        self.config = None
+        self.dirty = False
+        self.pending = None
+        self.lock = asyncio.Lock()
+
+    async def save(self, config: Config, wait: bool = False) -> None:
+        """Mark the config dirty and schedule a flush.
+
+        :param config: The config.
+        :param wait: Wait until the config is written to disk.
+        """
+        self.config = config
+        self.dirty = True
+        if self.pending is None:
+            self.pending = asyncio.ensure_future(self.flush_later())
+        if wait:
+            await asyncio.shield(self.pending)
+
+    async def flush_later(self) -> None:
+        """Flush the config after the delay, until it is written and no longer dirty."""
+        delay = self.delay
+        while True:
+            await asyncio.sleep(delay)
+            try:
+                await self.flush()
+            except Exception as e:
+                delay = min(max(delay, 1) * 2, self.max_retry_delay)
+                log.error(f'Failed to save the config to {self.path}, trying again in {delay} seconds: {e!r}')
+                continue
+            if not self.dirty:
+                break
+            delay = self.delay
+        self.pending = None
+
+    @timeit
+    @logger
+    async def flush(self) -> None:
+        """Write the config to disk if it is dirty."""
+        async with self.lock:
+            if not self.dirty:
+                return
+            self.dirty = False
+            snapshot = self.config.to_json()
+            try:
+                await asyncio.get_event_loop().run_in_executor(None, self.write, snapshot)
+            except Exception:
+                self.dirty = True
+                raise
+
+    def flush_sync(self) -> None:
+        """Write the config to disk if it is dirty, without the event loop. Used on shutdown."""
+        if self.dirty:
+            self.dirty = False
+            self.write(self.config.to_json())
+
+    def write(self, snapshot: dict) -> None:
+        if self.shard is None:
+            write(self.path, snapshot)
+        else:
+            write_shard(self.path, snapshot, *self.shard)
+
+
+saver = Saver()
+
+
 @timeit
 @logger
-async def save(config: Config) -> None:
-    async with aiofiles.open(file=CONFIG_FILE, mode='w') as file:
-        await file.write(json.dumps(obj=asdict(config), indent=4))
+async def save(config: Config, wait: bool = False) -> None:
+    """Save the config with the write-behind saver.
+
+    :param config: The config.
+    :param wait: Wait until the config is written to disk.
+    """
+    await saver.save(config=config, wait=wait)
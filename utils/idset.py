@@ -0,0 +1,90 @@
+import sys
+from array import array
+from bisect import bisect_left
+
+
+class IdSet:
+    """Immutable set of IDs, used for the guild lists.
+
+    Lists of up to `large` IDs are held as a frozenset. Larger lists are held as a sorted array of 64 bit integers
+    searched with bisect, which takes 8 bytes per ID instead of about 60.
+    Lists longer than `compact` IDs are stored as the first ID followed by the differences between the sorted IDs,
+    which keeps lists of neighbouring IDs, like the systems of a region, short in the config file.
+    """
+    __slots__ = ('ids',)
+    large = 10000
+    compact = 64
+
+    def __init__(self, ids=()):
+        ids = sorted(set(ids))
+        self.ids = array('q', ids) if len(ids) > self.large else frozenset(ids)
+
+    @classmethod
+    def from_json(cls, stored):
+        """Make the set from a list as it is stored in the config.
+
+        :param stored: A list of IDs, or a dictionary with the differences between the sorted IDs under 'deltas'.
+        :return: The set.
+        """
+        if isinstance(stored, dict):
+            ids = []
+            current = 0
+            for delta in stored.get('deltas', ()):
+                current += delta
+                ids.append(current)
+            return cls(ids)
+        return cls(int(_id) for _id in stored or ())
+
+    def to_json(self):
+        ids = sorted(self.ids) if isinstance(self.ids, frozenset) else self.ids.tolist()
+        if len(ids) <= self.compact:
+            return ids
+        return {'deltas': [ids[0]] + [ids[i] - ids[i - 1] for i in range(1, len(ids))]}
+
+    @property
+    def members(self):
+        """The fastest container to test membership with, a frozenset or the set itself."""
+        return self.ids if isinstance(self.ids, frozenset) else self
+
+    @property
+    def nbytes(self) -> int:
+        """Memory used by the IDs in bytes."""
+        if isinstance(self.ids, frozenset):
+            return sys.getsizeof(self.ids) + sum(sys.getsizeof(_id) for _id in self.ids)
+        return sys.getsizeof(self.ids)
+
+    def __contains__(self, _id) -> bool:
+        ids = self.ids
+        if isinstance(ids, frozenset):
+            return _id in ids
+        index = bisect_left(ids, _id)
+        return index < len(ids) and ids[index] == _id
+
+    def __iter__(self):
+        return iter(self.ids)
+
+    def __len__(self) -> int:
+        return len(self.ids)
+
+    def __eq__(self, other) -> bool:
+        return isinstance(other, IdSet) and set(self.ids) == set(other.ids)
+
+    def __hash__(self) -> int:
+        return hash(frozenset(self.ids))
+
+    def __repr__(self) -> str:
+        return f'IdSet({len(self)} IDs)'
+
+    def isdisjoint(self, other) -> bool:
+        return not any(_id in self for _id in other)
+
+    def union(self, ids) -> 'IdSet':
+        return IdSet([*self.ids, *ids])
+
+    __or__ = union
+
+    def __copy__(self):
+        return self
+
+    def __deepcopy__(self, memo):
+        return self
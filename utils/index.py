@@ -0,0 +1,166 @@
+from utils.dataclass import (Guild, Filter, Killmail, Zkb)
+from utils.predicate import (compile_filter, members, victim_ids, attacker_ids)
+from utils.universe import Universe
+
+
+class Candidate:
+    """A filter of a guild together with its compiled predicate."""
+    __slots__ = ('guild', 'filt', 'predicate')
+
+    def __init__(self, guild: Guild, filt: Filter, predicate):
+        self.guild = guild
+        self.filt = filt
+        self.predicate = predicate
+
+
+class FilterIndex:
+    """Inverted index from killmail attributes to the filters that could match the killmail.
+
+    Every enabled filter is indexed on its most selective list or range constraint, so a killmail only
+    touches filters that could possibly match. Filters without such a constraint are kept in a residual bucket.
+    """
+    attributes = ['system', 'victim_ship', 'attacker_ship', 'victim_entity', 'attacker_entity', 'item']
+
+    def __init__(self, universe: Universe):
+        self.universe = universe
+        self.buckets = {attribute: {} for attribute in self.attributes}
+        self.residual = set()
+        self.guilds = {}
+        self.users = {'attackers': 0, 'items': 0}
+        self.skip = frozenset(['attackers', 'items'])
+
+    def update(self, guild: Guild):
+        """Compile and index all filters of a guild, replacing what was previously indexed for it.
+
+        Must be called whenever the filters or lists of the guild change.
+
+        :param guild: The guild.
+        """
+        self.remove(guild.id)
+        entries = []
+        for filt in guild.filters.values():
+            if not filt.enabled:
+                continue
+            predicate = compile_filter(filt=filt, lists=guild.lists, staging=guild.staging, universe=self.universe)
+            candidate = Candidate(guild=guild, filt=filt, predicate=predicate)
+            key = self.key(filt=filt, lists=guild.lists, staging=guild.staging)
+            if key is None:
+                self.residual.add(candidate)
+            else:
+                attribute, values = key
+                bucket = self.buckets[attribute]
+                for value in values:
+                    bucket.setdefault(value, set()).add(candidate)
+            uses = self.uses(filt)
+            for part in uses:
+                self.users[part] += 1
+            entries.append((candidate, key, uses))
+        self.guilds[guild.id] = entries
+        self.update_skip()
+
+    def remove(self, guild_id: int):
+        """Remove all filters of a guild from the index.
+
+        :param guild_id: The guild ID.
+        """
+        entries = self.guilds.pop(guild_id, None)
+        if entries is None:
+            return
+        for candidate, key, uses in entries:
+            for part in uses:
+                self.users[part] -= 1
+            if key is None:
+                self.residual.discard(candidate)
+                continue
+            attribute, values = key
+            bucket = self.buckets[attribute]
+            for value in values:
+                candidates = bucket.get(value)
+                if candidates is not None:
+                    candidates.discard(candidate)
+                    if not candidates:
+                        del bucket[value]
+        self.update_skip()
+
+    @staticmethod
+    def uses(filt: Filter) -> tuple:
+        """Find the parts of a killmail a filter uses that decoding can skip.
+
+        :param filt: The filter.
+        :return: A tuple with 'attackers' and 'items' if the filter uses them.
+        """
+        uses = ()
+        if filt.action == 'use' and (filt.what or filt.who or filt.who_ignore):
+            uses += ('attackers',)
+        if filt.items:
+            uses += ('items',)
+        return uses
+
+    def update_skip(self):
+        """Work out which parts of a killmail no indexed filter ever uses, so decoding can skip them.
+
+        The filters using each part are counted as they are added and removed, so this does not look at the filters.
+        """
+        self.skip = frozenset(part for part, users in self.users.items() if not users)
+
+    def key(self, filt: Filter, lists: dict, staging: int):
+        """Find the most selective list or range constraint of a filter.
+
+        :param filt: The filter.
+        :param lists: The guild lists.
+        :param staging: The staging system of the guild.
+        :return: A tuple with the attribute and the values to index the filter on, or None if it has no such constraint.
+        """
+        constraints = []
+        if filt.where:
+            constraints.append(('system', members(lists, filt.where)))
+        if filt.range and staging and self.universe.systems:
+            constraints.append(('system', self.universe.systems_in_range(staging, filt.range)))
+        if filt.what:
+            constraints.append(('victim_ship' if filt.action == 'kill' else 'attacker_ship', members(lists, filt.what)))
+        if filt.who:
+            constraints.append(('victim_entity' if filt.action == 'kill' else 'attacker_entity', members(lists, filt.who)))
+        if filt.items:
+            constraints.append(('item', members(lists, filt.items)))
+        if not constraints:
+            return None
+        return min(constraints, key=lambda constraint: len(constraint[1]))
+
+    def candidates(self, killmail: Killmail) -> set:
+        """Find the filters that could match a killmail.
+
+        :param killmail: The killmail.
+        :return: A set of candidates, their predicates still have to be evaluated.
+        """
+        found = set(self.residual)
+        buckets = self.buckets
+
+        def probe(attribute, values):
+            bucket = buckets[attribute]
+            if bucket:
+                for value in values:
+                    candidates = bucket.get(value)
+                    if candidates:
+                        found.update(candidates)
+
+        probe('system', (killmail.solar_system_id,))
+        probe('victim_ship', (killmail.victim.ship_type_id,))
+        probe('victim_entity', victim_ids(killmail))
+        if buckets['attacker_ship']:
+            probe('attacker_ship', {attacker.ship_type_id for attacker in killmail.attackers})
+        if buckets['attacker_entity']:
+            probe('attacker_entity', {_id for attacker in killmail.attackers for _id in attacker_ids(attacker)})
+        if buckets['item']:
+            probe('item', {item.item_type_id for item in killmail.victim.items})
+        return found
+
+    def match(self, zkb: Zkb, killmail: Killmail) -> list:
+        """Find the filters that match a killmail, leaving out guilds the killmail was already reported to.
+
+        :param zkb: The zKillboard data for this killmail.
+        :param killmail: The killmail.
+        :return: A list of matching candidates.
+        """
+        killmail_id = killmail.killmail_id
+        return [candidate for candidate in self.candidates(killmail)
+                if killmail_id not in candidate.guild.reported_killmail_id and candidate.predicate(zkb, killmail)]
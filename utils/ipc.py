@@ -0,0 +1,165 @@
+import asyncio
+import json
+import logging
+import os
+import struct
+from collections import deque
+
+
+log = logging.getLogger('discord')
+
+HEADER = struct.Struct('>I')
+
+
+def shard_of(guild_id: int, shard_count: int) -> int:
+    """Get the shard a guild belongs to, the same way Discord assigns guilds to shards.
+
+    :param guild_id: The guild ID.
+    :param shard_count: Number of shards.
+    :return: The shard ID.
+    """
+    return (guild_id >> 22) % shard_count
+
+
+def frame(package: dict) -> bytes:
+    body = json.dumps(package).encode()
+    return HEADER.pack(len(body)) + body
+
+
+async def read_frame(reader: asyncio.StreamReader) -> dict:
+    """Read one length prefixed package.
+
+    :param reader: The stream.
+    :return: The package.
+    :raises asyncio.IncompleteReadError: When the stream is closed.
+    """
+    header = await reader.readexactly(HEADER.size)
+    return json.loads(await reader.readexactly(HEADER.unpack(header)[0]))
+
+
+class FanOut:
+    """Unix socket server that sends every published package to every shard.
+
+    Packages are sent as length prefixed JSON frames, numbered in the order they were published. A shard says who it
+    is and the last package it got when it connects, and is sent everything it missed since.
+    Published packages are kept until every shard was sent them, and the last max_buffer bytes of packages are kept
+    after that, so a shard that disconnects gets the packages that were lost on the way when it reconnects.
+    Publishing waits while a shard that is not connected or falls behind would need more than max_buffer bytes kept
+    for it, so a missing or slow shard holds up the source instead of losing killmails.
+    """
+
+    def __init__(self, path: str, shard_count: int, max_buffer: int = 16 * 1024 * 1024):
+        """
+        :param path: Path of the Unix socket.
+        :param shard_count: Number of shards that get the packages.
+        :param max_buffer: Max bytes kept for the shards.
+        """
+        self.path = path
+        self.shard_count = shard_count
+        self.max_buffer = max_buffer
+        self.stream = os.urandom(8).hex()
+        self.sequence = 0
+        self.history = deque()
+        self.history_bytes = 0
+        self.subscribers = {}
+        self.sent = {shard_id: 0 for shard_id in range(shard_count)}
+        self.server = None
+        self.changed = asyncio.Condition()
+
+    async def start(self):
+        if os.path.exists(self.path):
+            os.remove(self.path)
+        self.server = await asyncio.start_unix_server(self.subscribe, path=self.path)
+        log.info(f'Fanning out killmails on {self.path}')
+
+    async def subscribe(self, reader: asyncio.StreamReader, writer: asyncio.StreamWriter):
+        try:
+            hello = await read_frame(reader)
+            shard_id = int(hello['shard_id'])
+        except (asyncio.IncompleteReadError, ConnectionError, ValueError, KeyError, TypeError) as e:
+            log.warning(f'Dropping shard connection without a valid hello: {e!r}')
+            writer.close()
+            return
+        if shard_id not in self.sent:
+            log.warning(f'Dropping shard {shard_id}, only expecting {self.shard_count} shards')
+            writer.close()
+            return
+
+        resume = (hello.get('sequence') or 0) if hello.get('stream') == self.stream else 0
+        if self.history and resume + 1 < self.history[0][0]:
+            log.warning(f'Shard {shard_id} missed {self.history[0][0] - resume - 1} packages')
+        writer.transport.set_write_buffer_limits(high=self.max_buffer)
+        previous = self.subscribers.get(shard_id)
+        if previous is not None:
+            previous.close()
+        self.subscribers[shard_id] = writer
+        for sequence, data in self.history:
+            if sequence > resume:
+                writer.write(data)
+        self.sent[shard_id] = self.sequence
+        log.info(f'Shard {shard_id} connected from package {resume}, {len(self.subscribers)} connected')
+        async with self.changed:
+            self.changed.notify_all()
+        try:
+            await writer.drain()
+            await reader.read()
+        except ConnectionError:
+            pass
+        finally:
+            if self.subscribers.get(shard_id) is writer:
+                del self.subscribers[shard_id]
+            writer.close()
+            log.info(f'Shard {shard_id} disconnected, {len(self.subscribers)} connected')
+
+    async def wait_for(self, count: int):
+        """Wait until a number of shards are connected.
+
+        :param count: Number of shards.
+        """
+        async with self.changed:
+            await self.changed.wait_for(lambda: len(self.subscribers) >= count)
+
+    def trim(self) -> bool:
+        """Drop the oldest packages that every shard was sent, while more than max_buffer bytes are kept.
+
+        :return: True if there is room for more packages.
+        """
+        delivered = min(self.sent.values(), default=self.sequence)
+        while self.history and self.history_bytes > self.max_buffer and self.history[0][0] <= delivered:
+            self.history_bytes -= len(self.history.popleft()[1])
+        return self.history_bytes <= self.max_buffer
+
+    async def publish(self, package: dict):
+        """Send a package to every shard, waiting while a shard would need more than max_buffer bytes kept for it.
+
+        :param package: The package.
+        """
+        if not self.trim():
+            log.warning(f'Waiting for shards {sorted(set(self.sent) - set(self.subscribers))} to catch up')
+            async with self.changed:
+                await self.changed.wait_for(self.trim)
+
+        self.sequence += 1
+        data = frame({'stream': self.stream, 'sequence': self.sequence, 'package': package})
+        self.history.append((self.sequence, data))
+        self.history_bytes += len(data)
+        writers = list(self.subscribers.items())
+        for shard_id, writer in writers:
+            writer.write(data)
+            self.sent[shard_id] = self.sequence
+        for shard_id, writer in writers:
+            try:
+                await writer.drain()
+            except ConnectionError as e:
+                log.warning(f'Failed to send to shard {shard_id}: {e!r}')
+                writer.close()
+
+    async def close(self):
+        """Wait until every shard was sent every package, and close the connections."""
+        async with self.changed:
+            await self.changed.wait_for(lambda: min(self.sent.values(), default=self.sequence) >= self.sequence)
+        self.server.close()
+        for writer in list(self.subscribers.values()):
+            await writer.drain()
+            writer.close()
+        await self.server.wait_closed()
@@ -0,0 +1,86 @@
+import json
+import logging
+import os
+
+from utils.dataclass import Config
+
+
+log = logging.getLogger('discord')
+
+JOURNAL_FILE = 'config/reported.jsonl'
+
+
+class Journal:
+    """Append-only journal of reported killmails.
+
+    Every match is appended as one compact record instead of rewriting the whole config.
+    The journal is replayed on top of the config on startup, and compacted into the config once it grows too long.
+    """
+
+    def __init__(self, path: str = JOURNAL_FILE, compact_every: int = 1000):
+        self.path = path
+        self.rotated_path = f'{path}.old'
+        self.compact_every = compact_every
+        self.count = 0
+        self.file = None
+
+    def open(self):
+        if self.file is None:
+            self.file = open(self.path, mode='a')
+
+    def append(self, guild_id: int, killmail_id: int, time: str) -> bool:
+        """Append a reported killmail to the journal.
+
+        :param guild_id: The guild the killmail was reported to.
+        :param killmail_id: The killmail ID.
+        :param time: When the killmail was reported.
+        :return: True if the journal is due for compaction.
+        """
+        self.open()
+        self.file.write(json.dumps([guild_id, killmail_id, time], separators=(',', ':')) + '\n')
+        self.file.flush()
+        self.count += 1
+        return self.count >= self.compact_every
+
+    def replay(self, config: Config) -> int:
+        """Apply the records in the journal to the guilds in the config.
+
+        :param config: The config.
+        :return: The number of records replayed.
+        """
+        count = 0
+        for path in [self.rotated_path, self.path]:
+            if not os.path.exists(path):
+                continue
+            with open(path, mode='r') as file:
+                for line in file:
+                    try:
+                        guild_id, killmail_id, time = json.loads(line)
+                    except ValueError:
+                        log.warning(f'Skipping bad record in {path}: {line!r}')
+                        continue
+                    config.guilds.add_reported(guild_id=guild_id, killmail_id=killmail_id, time=time)
+                    count += 1
+        self.count = count
+        log.info(f'Replayed {count} reported killmails from {self.path}')
+        return count
+
+    def rotate(self):
+        """Start a new journal, keeping the old one until the config it is compacted into is saved."""
+        if self.file is not None:
+            self.file.close()
+            self.file = None
+        if os.path.exists(self.path):
+            if os.path.exists(self.rotated_path):
+                # the previous compaction never finished, keep its records too
+                with open(self.rotated_path, mode='a') as rotated, open(self.path, mode='r') as file:
+                    rotated.write(file.read())
+                os.remove(self.path)
+            else:
+                os.replace(self.path, self.rotated_path)
+        self.count = 0
+
+    def discard_rotated(self):
+        """Remove the old journal after the config has been saved."""
+        if os.path.exists(self.rotated_path):
+            os.remove(self.rotated_path)
@@ -0,0 +1,139 @@
+import logging
+from bisect import bisect_left
+
+from aiohttp import web
+
+
+log = logging.getLogger('discord')
+
+DEFAULT_BUCKETS = (0.0005, 0.001, 0.0025, 0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1, 2.5, 5, 10, 30, 60)
+LAG_BUCKETS = (1, 2, 5, 10, 30, 60, 120, 300, 600, 1800, 3600)
+
+
+def format_labels(labels: tuple, extra: str = '') -> str:
+    parts = [f'{key}="{value}"' for key, value in labels]
+    if extra:
+        parts.append(extra)
+    return '{' + ','.join(parts) + '}' if parts else ''
+
+
+class Counter:
+    """Monotonically increasing counter.
+
+    A counter kept up to date somewhere else can be given a function instead, which is read when rendering.
+    """
+    __slots__ = ('labels', 'value', 'func')
+
+    def __init__(self, labels: tuple, func=None):
+        self.labels = labels
+        self.value = 0
+        self.func = func
+
+    def inc(self, amount: float = 1):
+        self.value += amount
+
+    def render(self, name: str) -> list:
+        value = self.value if self.func is None else self.func()
+        return [f'{name}{format_labels(self.labels)} {value}']
+
+
+class Gauge:
+    """Value read from a function when the metrics are rendered, so it costs nothing to keep up to date."""
+    __slots__ = ('labels', 'func')
+
+    def __init__(self, labels: tuple, func):
+        self.labels = labels
+        self.func = func
+
+    def render(self, name: str) -> list:
+        return [f'{name}{format_labels(self.labels)} {self.func()}']
+
+
+class Histogram:
+    """Histogram with fixed buckets. Observing a value is a bisect and two additions."""
+    __slots__ = ('labels', 'buckets', 'counts', 'sum')
+
+    def __init__(self, labels: tuple, buckets: tuple):
+        self.labels = labels
+        self.buckets = buckets
+        self.counts = [0] * (len(buckets) + 1)
+        self.sum = 0.0
+
+    def observe(self, value: float):
+        self.counts[bisect_left(self.buckets, value)] += 1
+        self.sum += value
+
+    def render(self, name: str) -> list:
+        lines = []
+        cumulative = 0
+        for bound, count in zip(self.buckets, self.counts):
+            cumulative += count
+            le = f'le="{bound}"'
+            lines.append(f'{name}_bucket{format_labels(self.labels, le)} {cumulative}')
+        cumulative += self.counts[-1]
+        le = 'le="+Inf"'
+        lines.append(f'{name}_bucket{format_labels(self.labels, le)} {cumulative}')
+        lines.append(f'{name}_sum{format_labels(self.labels)} {self.sum}')
+        lines.append(f'{name}_count{format_labels(self.labels)} {cumulative}')
+        return lines
+
+
+class Registry:
+    """All metrics, rendered in the Prometheus text format.
+
+    Metrics are created once and kept by the caller, so recording a sample never goes through the registry.
+    """
+
+    def __init__(self):
+        self.families = {}
+
+    def metric(self, kind: str, name: str, description: str, labels: dict, make):
+        family = self.families.get(name)
+        if family is None:
+            family = self.families[name] = {'kind': kind, 'description': description, 'metrics': {}}
+        key = tuple(sorted((labels or {}).items()))
+        metric = family['metrics'].get(key)
+        if metric is None:
+            metric = family['metrics'][key] = make(key)
+        return metric
+
+    def counter(self, name: str, description: str, labels: dict = None, func=None) -> Counter:
+        return self.metric('counter', name, description, labels, lambda key: Counter(key, func))
+
+    def gauge(self, name: str, description: str, func, labels: dict = None) -> Gauge:
+        return self.metric('gauge', name, description, labels, lambda key: Gauge(key, func))
+
+    def histogram(self, name: str, description: str, labels: dict = None,
+                  buckets: tuple = DEFAULT_BUCKETS) -> Histogram:
+        return self.metric('histogram', name, description, labels, lambda key: Histogram(key, buckets))
+
+    def render(self) -> str:
+        lines = []
+        for name, family in self.families.items():
+            lines.append(f'# HELP {name} {family["description"]}')
+            lines.append(f'# TYPE {name} {family["kind"]}')
+            for metric in family['metrics'].values():
+                lines.extend(metric.render(name))
+        return '\n'.join(lines) + '\n'
+
+
+registry = Registry()
+
+
+async def serve(host: str, port: int) -> web.AppRunner:
+    """Serve the metrics over HTTP on /metrics.
+
+    :param host: The host to listen on.
+    :param port: The port to listen on.
+    :return: The runner, clean it up to stop serving.
+    """
+    async def handle(request):
+        return web.Response(text=registry.render(), content_type='text/plain', charset='utf-8')
+
+    app = web.Application()
+    app.router.add_get('/metrics', handle)
+    runner = web.AppRunner(app)
+    await runner.setup()
+    await web.TCPSite(runner, host=host, port=port).start()
+    log.info(f'Serving metrics on http://{host}:{port}/metrics')
+    return runner
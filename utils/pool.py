@@ -0,0 +1,195 @@
+import asyncio
+import copy
+import logging
+import multiprocessing
+from concurrent.futures import ProcessPoolExecutor
+from concurrent.futures.process import BrokenProcessPool
+
+from utils.dataclass import (Guild, Killmail, Zkb)
+from utils.decoder import decode
+from utils.dedup import ReportedKillmails
+from utils.index import (FilterIndex, Candidate)
+from utils.universe import Universe
+
+
+log = logging.getLogger('discord')
+
+# State of a worker process, every worker holds the index of its own partition of the guilds.
+worker = {}
+
+
+def set_universe(universe: Universe):
+    worker['index'] = FilterIndex(universe=universe)
+
+
+def ready() -> bool:
+    return 'index' in worker
+
+
+def update_guild(guild: Guild):
+    worker['index'].update(guild)
+
+
+def remove_guild(guild_id: int):
+    worker['index'].remove(guild_id)
+
+
+def match(zkb: Zkb, killmail_data: [bytes, dict]) -> list:
+    """Match a killmail against the guilds of this worker.
+
+    :param zkb: The zKillboard data for this killmail.
+    :param killmail_data: The killmail as a response body or dictionary.
+    :return: A list of tuples of guild ID and filter name.
+    """
+    index = worker['index']
+    killmail = decode(Killmail, killmail_data, skip=index.skip)
+    return [(candidate.guild.id, candidate.filt.name) for candidate in index.candidates(killmail)
+            if candidate.predicate(zkb, killmail)]
+
+
+class MatcherPool:
+    """Match killmails in worker processes, with the guilds partitioned across the workers.
+
+    Every worker is a single process executor, so the updates and matches sent to it are handled in order.
+    Workers compile and index their own guilds, get the raw killmail and only send back the guild ID and
+    filter name of the matches, which are looked up in the guilds of the main process.
+    Workers are started from a fork server, so they never inherit the threads or locks of the main process, and get
+    the universe and guilds sent to them explicitly. The fork server imports the main module again without running it
+    as __main__, so entrypoints must keep their side effects behind a __main__ check.
+    A worker that dies, for example when it runs out of memory, is replaced by a new one that gets its guilds again.
+    """
+
+    def __init__(self, processes: int, universe: Universe):
+        """
+        :param processes: Number of worker processes.
+        :param universe: The universe.
+        """
+        self.context = multiprocessing.get_context('forkserver')
+        self.universe = universe
+        self.executors = [self.spawn() for _ in range(processes)]
+        self.guilds = {}
+        for future in [executor.submit(ready) for executor in self.executors]:
+            future.result()
+
+    def spawn(self) -> ProcessPoolExecutor:
+        return ProcessPoolExecutor(max_workers=1, mp_context=self.context, initializer=set_universe,
+                                   initargs=(self.universe,))
+
+    def respawn(self, number: int, broken: ProcessPoolExecutor):
+        """Replace a worker whose process died, and send it the universe and its guilds again.
+
+        :param number: The number of the worker.
+        :param broken: The executor of the dead worker, nothing is done if it was already replaced.
+        """
+        if self.executors[number] is not broken:
+            return
+        log.error(f'Matcher worker {number} died, starting a new one')
+        broken.shutdown(wait=False)
+        self.executors[number] = self.spawn()
+        for guild in list(self.guilds.values()):
+            if guild.id % len(self.executors) == number:
+                self.update(guild)
+
+    def submit(self, guild_id: int, fn, *args):
+        """Send a call to the worker of a guild and log it if it fails.
+
+        :param guild_id: The guild ID.
+        :param fn: The function to call in the worker.
+        :param args: The arguments.
+        """
+        number = guild_id % len(self.executors)
+        executor = self.executors[number]
+        try:
+            future = executor.submit(fn, *args)
+        except BrokenProcessPool:
+            # the guilds are sent to the new worker, including the guild of this call
+            self.respawn(number, executor)
+            return
+        future.add_done_callback(lambda done: self.check(done, f'{fn.__name__} for guild {guild_id}'))
+
+    @staticmethod
+    def check(future, call: str):
+        """Log a failed call in a worker. Calls lost with a dead worker are not logged, the worker is replaced.
+
+        :param future: The future of the call.
+        :param call: Description of the call.
+        """
+        error = future.exception()
+        if error is not None and not isinstance(error, BrokenProcessPool):
+            log.error(f'Matcher worker failed {call}: {error!r}')
+
+    def update(self, guild: Guild):
+        """Send the filters and lists of a guild to its worker.
+
+        Must be called whenever the filters or lists of the guild change.
+
+        :param guild: The guild.
+        """
+        self.guilds[guild.id] = guild
+        shallow = copy.copy(guild)
+        shallow.reported_killmail_id = ReportedKillmails()
+        self.submit(guild.id, update_guild, shallow)
+
+    def remove(self, guild_id: int):
+        self.guilds.pop(guild_id, None)
+        self.submit(guild_id, remove_guild, guild_id)
+
+    def set_universe(self, universe: Universe):
+        """Replace the universe in every worker and index the guilds again.
+
+        :param universe: The new universe.
+        """
+        self.universe = universe
+        for number, executor in enumerate(list(self.executors)):
+            try:
+                executor.submit(set_universe, universe).add_done_callback(
+                    lambda done, number=number: self.check(done, f'set_universe in worker {number}'))
+            except BrokenProcessPool:
+                self.respawn(number, executor)
+        for guild in list(self.guilds.values()):
+            self.update(guild)
+
+    async def match_in(self, number: int, zkb: Zkb, killmail_data: [bytes, dict]) -> list:
+        """Match a killmail in one worker, replacing the worker if it died.
+
+        The killmail is matched once more in the new worker. If that worker dies as well, it is replaced again and
+        the error is raised, so a killmail that kills workers is given up on.
+
+        :param number: The number of the worker.
+        :param zkb: The zKillboard data for this killmail.
+        :param killmail_data: The killmail as it was received.
+        :return: A list of tuples of guild ID and filter name.
+        """
+        loop = asyncio.get_event_loop()
+        for attempt in range(2):
+            executor = self.executors[number]
+            try:
+                return await loop.run_in_executor(executor, match, zkb, killmail_data)
+            except BrokenProcessPool:
+                self.respawn(number, executor)
+                if attempt:
+                    raise
+
+    async def match(self, zkb: Zkb, killmail: Killmail, killmail_data: [bytes, dict]) -> list:
+        """Find the filters that match a killmail, leaving out guilds the killmail was already reported to.
+
+        :param zkb: The zKillboard data for this killmail.
+        :param killmail: The decoded killmail.
+        :param killmail_data: The killmail as it was received, a response body or the dictionary from the package.
+        :return: A list of matching candidates, without predicates.
+        """
+        results = await asyncio.gather(*[self.match_in(number, zkb, killmail_data)
+                                         for number in range(len(self.executors))])
+        found = []
+        for guild_id, name in (pair for result in results for pair in result):
+            guild = self.guilds.get(guild_id)
+            if guild is None or killmail.killmail_id in guild.reported_killmail_id:
+                continue
+            filt = guild.filters.get(name)
+            if filt is not None:
+                found.append(Candidate(guild=guild, filt=filt, predicate=None))
+        return found
+
+    def shutdown(self):
+        for executor in self.executors:
+            executor.shutdown()
@@ -0,0 +1,139 @@
+import logging
+
+from utils.dataclass import (Filter, Killmail, Zkb)
+from utils.idset import IdSet
+from utils.universe import Universe
+
+
+log = logging.getLogger('discord')
+
+
+def never(zkb: Zkb, killmail: Killmail) -> bool:
+    """Predicate used for filters that can never match."""
+    return False
+
+
+def members(lists: dict, name: str):
+    """Get the list referenced by name as a container with fast membership tests.
+
+    :param lists: The guild lists.
+    :param name: Name of the list.
+    :return: The items in the list, or an empty frozenset if the list does not exist.
+    """
+    ids = lists.get(name)
+    if ids is None:
+        return frozenset()
+    if isinstance(ids, IdSet):
+        return ids.members
+    return frozenset(ids)
+
+
+def compile_filter(filt: Filter, lists: dict, staging: int, universe: Universe):
+    """Compile a filter and the lists it references into a single synchronous predicate.
+
+    The checks are ordered cheapest first and evaluated with short-circuiting.
+    Range and security status checks look the solar system up in the local universe store. While the store is
+    empty they are left out, and have to be checked with ESI by the caller.
+
+    :param filt: The filter.
+    :param lists: The guild lists.
+    :param staging: The staging system of the guild.
+    :param universe: The universe store.
+    :return: A function taking the zKillboard data and the killmail, returning True if all checks pass.
+    """
+    if filt.action not in ['kill', 'use']:
+        log.error(f'{filt.name} missing action')
+        return never
+
+    checks = []
+
+    if filt.isk_value:
+        isk_value = filt.isk_value
+        checks.append(lambda zkb, killmail: zkb.totalValue >= isk_value)
+
+    if filt.where:
+        where = members(lists, filt.where)
+        checks.append(lambda zkb, killmail: killmail.solar_system_id in where)
+
+    if filt.action == 'kill':
+        if filt.what:
+            what = members(lists, filt.what)
+            checks.append(lambda zkb, killmail: killmail.victim.ship_type_id in what)
+
+        if filt.who:
+            who = members(lists, filt.who)
+            checks.append(lambda zkb, killmail: not who.isdisjoint(victim_ids(killmail)))
+
+        if filt.who_ignore:
+            who_ignore = members(lists, filt.who_ignore)
+            checks.append(lambda zkb, killmail: who_ignore.isdisjoint(victim_ids(killmail)))
+
+    else:
+        if filt.what:
+            what = members(lists, filt.what)
+            checks.append(lambda zkb, killmail: any(attacker.ship_type_id in what
+                                                    for attacker in killmail.attackers))
+
+        if filt.who:
+            who = members(lists, filt.who)
+            checks.append(lambda zkb, killmail: any(not who.isdisjoint(attacker_ids(attacker))
+                                                    for attacker in killmail.attackers))
+
+        if filt.who_ignore:
+            who_ignore = members(lists, filt.who_ignore)
+            checks.append(lambda zkb, killmail: all(who_ignore.isdisjoint(attacker_ids(attacker))
+                                                    for attacker in killmail.attackers))
+
+    if filt.items:
+        items = members(lists, filt.items)
+        checks.append(lambda zkb, killmail: any(item.item_type_id in items for item in killmail.victim.items))
+
+    if universe.systems:
+        if filt.lowest_security is not None:
+            lowest_security = filt.lowest_security
+
+            def is_secure_enough(zkb, killmail):
+                security_status = universe.security_status(killmail.solar_system_id)
+                return security_status is not None and security_status >= lowest_security
+            checks.append(is_secure_enough)
+
+        if filt.highest_security is not None:
+            highest_security = filt.highest_security
+
+            def is_insecure_enough(zkb, killmail):
+                security_status = universe.security_status(killmail.solar_system_id)
+                return security_status is not None and security_status <= highest_security
+            checks.append(is_insecure_enough)
+
+        if filt.range and staging:
+            in_range = universe.systems_in_range(staging, filt.range)
+            checks.append(lambda zkb, killmail: killmail.solar_system_id in in_range)
+
+    checks = tuple(checks)
+
+    def predicate(zkb: Zkb, killmail: Killmail) -> bool:
+        for check in checks:
+            if not check(zkb, killmail):
+                return False
+        return True
+
+    return predicate
+
+
+def victim_ids(killmail: Killmail) -> tuple:
+    """Get the entity IDs of the victim.
+
+    :param killmail: The killmail.
+    :return: The alliance, corporation, character and faction ID of the victim.
+    """
+    victim = killmail.victim
+    return victim.alliance_id, victim.corporation_id, victim.character_id, victim.faction_id
+
+
+def attacker_ids(attacker) -> tuple:
+    """Get the entity IDs of an attacker.
+
+    :param attacker: The attacker.
+    :return: The alliance, corporation, character and faction ID of the attacker.
+    """
+    return attacker.alliance_id, attacker.corporation_id, attacker.character_id, attacker.faction_id
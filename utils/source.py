@@ -0,0 +1,260 @@
+import asyncio
+import datetime
+import gzip
+import json
+import logging
+import time
+from abc import (ABC, abstractmethod)
+
+import aiohttp
+
+from utils.ipc import (frame, read_frame)
+from utils.metrics import registry
+
+
+log = logging.getLogger('discord')
+
+
+class Source(ABC):
+    """Async iterator of raw killmail packages.
+
+    A package is a dictionary with the killmail ID under 'killID', the zKillboard data under 'zkb' and, if the source
+    has it, the ESI killmail under 'killmail'.
+    """
+
+    def __aiter__(self):
+        return self.packages()
+
+    @abstractmethod
+    def packages(self):
+        """Async generator of the packages."""
+
+
+class RedisQSource(Source):
+    """Long-poll the zKillboard redisQ."""
+
+    def __init__(self, fetch, url: str, queue_id: str, ttw: int, retry_delay: float):
+        """
+        :param fetch: The coroutine function used to make the requests.
+        :param url: The redisQ url.
+        :param queue_id: Persistent queue ID, so killmails are kept for us while we reconnect.
+        :param ttw: Seconds for redisQ to wait for a new killmail before answering.
+        :param retry_delay: Seconds to wait after a failed request.
+        """
+        self.fetch = fetch
+        self.url = url
+        self.params = {'queueID': queue_id, 'ttw': ttw}
+        self.retry_delay = retry_delay
+        self.poll_seconds = registry.histogram('kverna_redisq_poll_seconds', 'Time spent on a redisQ long-poll.')
+
+    async def packages(self):
+        while True:
+            start_time = time.perf_counter()
+            try:
+                data = await self.fetch(url=self.url, params=self.params)
+                self.poll_seconds.observe(time.perf_counter() - start_time)
+            except Exception as e:
+                log.error(f'Failed to poll redisQ: {e!r}')
+                await asyncio.sleep(self.retry_delay)
+                continue
+
+            package = data.get('package') if type(data) is dict else None
+            if package is not None:
+                yield package
+
+
+class WebSocketSource(Source):
+    """Subscribe to the zKillboard killstream over a WebSocket, reconnecting and resubscribing when it drops."""
+
+    def __init__(self, session: aiohttp.ClientSession, url: str, channel: str, retry_delay: float,
+                 max_retry_delay: float = 60):
+        """
+        :param session: The session to connect with.
+        :param url: The WebSocket url.
+        :param channel: The channel to subscribe to.
+        :param retry_delay: Seconds to wait before the first reconnect, doubled for every failed attempt.
+        :param max_retry_delay: Max seconds to wait before a reconnect.
+        """
+        self.session = session
+        self.url = url
+        self.channel = channel
+        self.retry_delay = retry_delay
+        self.max_retry_delay = max_retry_delay
+
+    @staticmethod
+    def package(message: dict) -> dict:
+        """Turn a killstream message into a package shaped like the ones from redisQ.
+
+        :param message: The killmail, with the zKillboard data under 'zkb'.
+        :return: The package.
+        """
+        return {'killID': message.get('killmail_id'), 'killmail': message, 'zkb': message.get('zkb')}
+
+    async def packages(self):
+        delay = self.retry_delay
+        while True:
+            try:
+                async with self.session.ws_connect(self.url, heartbeat=30) as websocket:
+                    await websocket.send_json({'action': 'sub', 'channel': self.channel})
+                    log.info(f'Subscribed to {self.channel} on {self.url}')
+                    delay = self.retry_delay
+                    async for message in websocket:
+                        if message.type == aiohttp.WSMsgType.TEXT:
+                            try:
+                                data = json.loads(message.data)
+                            except ValueError:
+                                log.warning(f'Skipping malformed message: {message.data[:80]!r}')
+                                continue
+                            if type(data) is dict and data.get('zkb') is not None:
+                                yield self.package(data)
+                        elif message.type in [aiohttp.WSMsgType.CLOSED, aiohttp.WSMsgType.ERROR]:
+                            break
+                log.warning(f'WebSocket {self.url} closed')
+            except (aiohttp.ClientError, asyncio.TimeoutError) as e:
+                log.error(f'WebSocket {self.url} failed: {e!r}')
+            await asyncio.sleep(delay)
+            delay = min(delay * 2, self.max_retry_delay)
+
+
+class IPCSource(Source):
+    """Receive packages fanned out by the ingestion process over a Unix socket.
+
+    The source tells the ingestion process which shard it is and the last package it got, so packages published
+    while it was disconnected are sent when it reconnects.
+    """
+
+    def __init__(self, path: str, shard_id: int, retry_delay: float, max_retry_delay: float = 60,
+                 reconnect: bool = True):
+        """
+        :param path: Path of the Unix socket.
+        :param shard_id: The shard ID.
+        :param retry_delay: Seconds to wait before the first reconnect, doubled for every failed attempt.
+        :param max_retry_delay: Max seconds to wait before a reconnect.
+        :param reconnect: Reconnect when the ingestion process closes the socket, instead of ending.
+        """
+        self.path = path
+        self.shard_id = shard_id
+        self.retry_delay = retry_delay
+        self.max_retry_delay = max_retry_delay
+        self.reconnect = reconnect
+        self.stream = None
+        self.sequence = 0
+
+    async def packages(self):
+        delay = self.retry_delay
+        while True:
+            try:
+                reader, writer = await asyncio.open_unix_connection(self.path)
+            except OSError as e:
+                log.error(f'Failed to connect to {self.path}: {e!r}')
+            else:
+                log.info(f'Connected to {self.path}')
+                delay = self.retry_delay
+                try:
+                    writer.write(frame({'shard_id': self.shard_id, 'stream': self.stream, 'sequence': self.sequence}))
+                    while True:
+                        message = await read_frame(reader)
+                        self.stream, self.sequence = message.get('stream'), message.get('sequence')
+                        yield message.get('package')
+                except (asyncio.IncompleteReadError, ConnectionError):
+                    log.warning(f'{self.path} closed')
+                finally:
+                    writer.close()
+                if not self.reconnect:
+                    return
+            await asyncio.sleep(delay)
+            delay = min(delay * 2, self.max_retry_delay)
+
+
+class ReplaySource(Source):
+    """Replay archived killmails from JSONL files, optionally gzip compressed.
+
+    Every line is either a redisQ response, a redisQ package or a killstream message.
+    """
+
+    def __init__(self, paths: list, speed: float = 0):
+        """
+        :param paths: The archive files, replayed in order.
+        :param speed: Real-time factor, 1 replays the killmails as fast as they happened. 0 replays at max speed.
+        """
+        self.paths = paths
+        self.speed = speed
+
+    @staticmethod
+    def package(line: dict) -> [dict, None]:
+        """Turn an archived line into a package.
+
+        :param line: The decoded line.
+        :return: The package, or None if the line holds no killmail.
+        """
+        if 'package' in line:
+            return line.get('package')
+        if 'zkb' in line and 'killmail' in line:
+            return line
+        if 'zkb' in line and 'killmail_id' in line:
+            return WebSocketSource.package(line)
+        return None
+
+    @staticmethod
+    def timestamp(package: dict) -> [float, None]:
+        killmail = package.get('killmail') or {}
+        killmail_time = killmail.get('killmail_time')
+        if killmail_time is None:
+            return None
+        return datetime.datetime.strptime(killmail_time, '%Y-%m-%dT%H:%M:%SZ').timestamp()
+
+    def lines(self):
+        for path in self.paths:
+            opener = gzip.open if path.endswith('.gz') else open
+            with opener(path, mode='rt') as file:
+                for line in file:
+                    if line.strip():
+                        yield line
+
+    async def packages(self):
+        previous = None
+        for line in self.lines():
+            try:
+                package = self.package(json.loads(line))
+            except ValueError:
+                log.warning(f'Skipping bad line: {line[:80]!r}')
+                continue
+            if package is None:
+                continue
+
+            if self.speed:
+                timestamp = self.timestamp(package)
+                if timestamp is not None:
+                    if previous is not None and timestamp > previous:
+                        await asyncio.sleep((timestamp - previous) / self.speed)
+                    previous = timestamp
+            yield package
+
+
+def make_source(source_config, fetch, session: aiohttp.ClientSession, shard_id: int = 0) -> Source:
+    """Make the killmail source selected in the config.
+
+    :param source_config: The config section with the source settings.
+    :param fetch: The coroutine function used to make requests.
+    :param session: The session to open WebSockets with.
+    :param shard_id: The shard ID, sent to the ingestion process.
+    :return: The source.
+    :raises ValueError: When redisQ is selected without a queue ID.
+    """
+    if source_config['source'] == 'websocket':
+        return WebSocketSource(session=session,
+                               url=source_config['websocket_url'],
+                               channel=source_config['websocket_channel'],
+                               retry_delay=source_config.getfloat('retry_delay'))
+    if source_config['source'] == 'ipc':
+        return IPCSource(path=source_config['ipc_socket'], shard_id=shard_id,
+                         retry_delay=source_config.getfloat('retry_delay'))
+    queue_id = source_config['queue_id'].strip()
+    if not queue_id:
+        raise ValueError('queue_id is not set in the intel section of config/bot.ini, redisQ queue IDs are global '
+                         'so every deployment needs a queue ID of its own')
+    return RedisQSource(fetch=fetch,
+                        url=source_config['redisq_url'],
+                        queue_id=queue_id,
+                        ttw=source_config.getint('ttw'),
+                        retry_delay=source_config.getfloat('retry_delay'))
@@ -0,0 +1,193 @@
+import functools
+import inspect
+import logging
+import reprlib
+import sys
+from random import random
+
+
+log = logging.getLogger('discord')
+trace_log = logging.getLogger('discord.trace')
+trace_log.setLevel(logging.DEBUG)
+
+
+class Truncated:
+    """Repr of a value that is only made, and truncated, if the log record is actually emitted."""
+    __slots__ = ('value', 'repr')
+
+    def __init__(self, value, short_repr: reprlib.Repr):
+        self.value = value
+        self.repr = short_repr
+
+    def __str__(self):
+        return self.repr.repr(self.value)
+
+
+class Trace:
+    """A traceable function and its state."""
+    __slots__ = ('name', 'func', 'rate', 'bindings')
+
+    def __init__(self, name: str, func):
+        self.name = name
+        self.func = func
+        self.rate = 1.0
+        self.bindings = []
+
+    @property
+    def enabled(self) -> bool:
+        return bool(self.bindings)
+
+
+class Tracer:
+    """Log the arguments and results of registered functions, only while tracing them is enabled.
+
+    Registering a function returns it untouched, so a function that is not traced costs nothing to call.
+    Enabling a trace rebinds every attribute of the bot's own modules and classes that refers to the function, or to
+    a wrapper of it, to a tracing wrapper, and disabling it puts the originals back. Third-party modules are left
+    alone. References taken before a trace is enabled, like a function stored on an instance, keep calling the
+    untraced function.
+    """
+
+    def __init__(self, max_length: int = 200, packages: tuple = ('cogs', 'utils')):
+        """
+        :param max_length: Max length of the argument and result reprs.
+        :param packages: The packages with the modules whose attributes are rebound, third-party modules are left alone.
+        """
+        self.packages = packages
+        self.traces = {}
+        self.repr = reprlib.Repr()
+        self.set_max_length(max_length)
+
+    def set_max_length(self, max_length: int):
+        """Set the max length of the argument and result reprs.
+
+        :param max_length: Max number of characters.
+        """
+        self.repr.maxstring = max_length
+        self.repr.maxother = max_length
+        self.repr.maxlong = max_length
+
+    def register(self, func):
+        """Register a function as traceable.
+
+        :param func: The function.
+        :return: The function itself.
+        """
+        name = f'{func.__module__}.{func.__qualname__}'
+        self.traces[name] = Trace(name=name, func=func)
+        return func
+
+    def find(self, name: str) -> list:
+        """Find the traces for a full name, or for every function with a name that ends with it.
+
+        :param name: The name, like 'utils.fetch.fetch', 'fetch' or 'intel.process_killmail'.
+        :return: A list of traces.
+        """
+        if name in self.traces:
+            return [self.traces[name]]
+        return [trace for key, trace in self.traces.items() if key.endswith(f'.{name}')]
+
+    def enable(self, name: str, rate: float = 1.0) -> list:
+        """Start tracing functions.
+
+        :param name: The function name, see find.
+        :param rate: The fraction of calls to log.
+        :return: The names of the traced functions.
+        """
+        traces = self.find(name)
+        for trace in traces:
+            trace.rate = rate
+            if not trace.enabled:
+                wrappers = {}
+                for owner, attribute, original in self.references(trace.func, self.modules()):
+                    if id(original) not in wrappers:
+                        wrappers[id(original)] = self.wrap(trace=trace, target=original)
+                    setattr(owner, attribute, wrappers[id(original)])
+                    trace.bindings.append((owner, attribute, original))
+            log.info(f'Tracing {trace.name} at rate {rate} ({len(trace.bindings)} references)')
+        return [trace.name for trace in traces]
+
+    def disable(self, name: str) -> list:
+        """Stop tracing functions.
+
+        :param name: The function name, see find.
+        :return: The names of the functions that are no longer traced.
+        """
+        traces = [trace for trace in self.find(name) if trace.enabled]
+        for trace in traces:
+            for owner, attribute, original in trace.bindings:
+                setattr(owner, attribute, original)
+            trace.bindings = []
+            log.info(f'Stopped tracing {trace.name}')
+        return [trace.name for trace in traces]
+
+    def modules(self) -> list:
+        """Get the loaded modules of the traced packages.
+
+        :return: A list of modules.
+        """
+        return [module for name, module in list(sys.modules.items())
+                if name in self.packages or name.startswith(tuple(f'{package}.' for package in self.packages))]
+
+    @staticmethod
+    def references(func, modules: list) -> list:
+        """Find the module and class attributes that refer to a function or to a wrapper of it.
+
+        :param func: The function.
+        :param modules: The modules to search.
+        :return: A list of tuples of owner, attribute name and the object it refers to.
+        """
+        def wraps_func(value) -> bool:
+            while inspect.isfunction(value):
+                if value is func:
+                    return True
+                value = getattr(value, '__wrapped__', None)
+            return False
+
+        found = []
+        for module in modules:
+            namespace = getattr(module, '__dict__', None)
+            if not isinstance(namespace, dict):
+                continue
+            for key, value in list(namespace.items()):
+                if wraps_func(value):
+                    found.append((module, key, value))
+                elif inspect.isclass(value) and value.__module__ == module.__name__:
+                    found.extend((value, attribute, member) for attribute, member in list(vars(value).items())
+                                 if wraps_func(member))
+        return found
+
+    def wrap(self, trace: Trace, target):
+        """Make the tracing wrapper for a function.
+
+        :param trace: The trace.
+        :param target: The function to wrap.
+        :return: The wrapped function.
+        """
+        name = trace.name
+        short_repr = self.repr
+
+        if inspect.iscoroutinefunction(target):
+            @functools.wraps(target)
+            async def wrapped(*args, **kwargs):
+                if trace.rate < 1 and random() >= trace.rate:
+                    return await target(*args, **kwargs)
+                trace_log.debug('%s called with args %s, kwargs %s', name,
+                                Truncated(args, short_repr), Truncated(kwargs, short_repr))
+                result = await target(*args, **kwargs)
+                trace_log.debug('%s returns %s', name, Truncated(result, short_repr))
+                return result
+        else:
+            @functools.wraps(target)
+            def wrapped(*args, **kwargs):
+                if trace.rate < 1 and random() >= trace.rate:
+                    return target(*args, **kwargs)
+                trace_log.debug('%s called with args %s, kwargs %s', name,
+                                Truncated(args, short_repr), Truncated(kwargs, short_repr))
+                result = target(*args, **kwargs)
+                trace_log.debug('%s returns %s', name, Truncated(result, short_repr))
+                return result
+        return wrapped
+
+
+tracer = Tracer()
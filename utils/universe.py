@@ -0,0 +1,277 @@
+import asyncio
+import json
+import logging
+import os
+from dataclasses import asdict
+
+from utils.decorator import (logger, timeit)
+from utils.dataclass import (from_dict, SolarSystem, Constellation, Region)
+from utils.file import write
+
+
+log = logging.getLogger('discord')
+
+UNIVERSE_FILE = 'data/universe.json'
+
+
+class Universe:
+    """Local store of the static universe data: solar systems, constellations and regions."""
+
+    def __init__(self, systems: dict = None, constellations: dict = None, regions: dict = None):
+        self.systems = systems or {}
+        self.constellations = constellations or {}
+        self.regions = regions or {}
+        self.ranges = {}
+        self.names = None
+
+    def system(self, system_id: int) -> [SolarSystem, None]:
+        """Get a solar system.
+
+        :param system_id: System ID.
+        :return: The solar system, or None if it is not in the store.
+        """
+        return self.systems.get(system_id)
+
+    def security_status(self, system_id: int) -> [float, None]:
+        """Get the security status of a solar system.
+
+        :param system_id: System ID.
+        :return: The security status, or None if the system is not in the store.
+        """
+        system = self.systems.get(system_id)
+        return system.security_status if system is not None else None
+
+    def region_id(self, system_id: int) -> [int, None]:
+        """Get the region a solar system is in.
+
+        :param system_id: System ID.
+        :return: The region ID, or None if the system is not in the store.
+        """
+        system = self.systems.get(system_id)
+        if system is None:
+            return None
+        constellation = self.constellations.get(system.constellation_id)
+        return constellation.region_id if constellation is not None else None
+
+    def distance_in_light_years(self, system_id: int, other_id: int) -> [float, None]:
+        """Get the distance between two solar systems.
+
+        :param system_id: System ID.
+        :param other_id: System ID of the other system.
+        :return: The distance in light years, or None if one of the systems is not in the store.
+        """
+        system = self.systems.get(system_id)
+        other = self.systems.get(other_id)
+        if system is None or other is None:
+            return None
+        return system.position.distance_in_light_years(other.position)
+
+    def systems_in_range(self, system_id: int, light_years: float) -> frozenset:
+        """Get all solar systems within range of a solar system.
+
+        The result is computed once per system and range, and reused until the store is refreshed.
+
+        :param system_id: System ID.
+        :param light_years: The range in light years.
+        :return: The IDs of all systems within range, including the system itself.
+        """
+        key = (system_id, light_years)
+        in_range = self.ranges.get(key)
+        if in_range is None:
+            origin = self.systems.get(system_id)
+            if origin is None:
+                in_range = frozenset()
+            else:
+                in_range = frozenset(other.system_id for other in self.systems.values()
+                                     if origin.position.distance_in_light_years(other.position) <= light_years)
+            self.ranges[key] = in_range
+        return in_range
+
+    def find(self, category: str, name: str) -> [int, None]:
+        """Find a region or constellation by name, ignoring case.
+
+        :param category: 'region' or 'constellation'.
+        :param name: The name.
+        :return: The ID, or None if there is no such region or constellation in the store.
+        """
+        if self.names is None:
+            self.names = {('region', region.name.lower()): region_id for region_id, region in self.regions.items()}
+            self.names.update({('constellation', constellation.name.lower()): constellation_id
+                               for constellation_id, constellation in self.constellations.items()})
+        return self.names.get((category, name.lower()))
+
+    def add(self, constellations: dict = None, regions: dict = None):
+        """Add constellations and regions to the store.
+
+        :param constellations: Constellations by ID.
+        :param regions: Regions by ID.
+        """
+        self.constellations.update(constellations or {})
+        self.regions.update(regions or {})
+        self.names = None
+
+    def replace(self, systems: dict, constellations: dict, regions: dict):
+        """Replace the contents of the store and drop everything computed from the old contents.
+
+        :param systems: Solar systems by ID.
+        :param constellations: Constellations by ID.
+        :param regions: Regions by ID.
+        """
+        self.systems = systems
+        self.constellations = constellations
+        self.regions = regions
+        self.ranges = {}
+        self.names = None
+
+
+def load_universe(path: str = UNIVERSE_FILE) -> Universe:
+    """Load the universe store from file.
+
+    :param path: Path to the universe file.
+    :return: The universe, empty if the file does not exist.
+    """
+    if not os.path.exists(path):
+        log.warning(f'{path} not found, range and security status filters are checked with ESI until it is built')
+        return Universe()
+
+    with open(path, mode='r') as file:
+        data = json.load(file)
+
+    systems = {int(key): from_dict(cls=SolarSystem, dictionary=value) for key, value in data.get('systems').items()}
+    constellations = {int(key): from_dict(cls=Constellation, dictionary=value)
+                      for key, value in data.get('constellations').items()}
+    regions = {int(key): from_dict(cls=Region, dictionary=value) for key, value in data.get('regions').items()}
+    log.info(f'Loaded {len(systems)} systems, {len(constellations)} constellations and {len(regions)} regions')
+    return Universe(systems=systems, constellations=constellations, regions=regions)
+
+
+def write_universe(path: str, data: dict) -> None:
+    """Write the universe store to file atomically.
+
+    :param path: Path to the universe file.
+    :param data: The universe as a dictionary.
+    """
+    os.makedirs(os.path.dirname(path), exist_ok=True)
+    write(path, data, indent=None)
+
+
+async def save_universe(universe: Universe, path: str = UNIVERSE_FILE) -> None:
+    """Write the universe store to file.
+
+    The store is copied on the event loop, and serialized and written in a worker thread.
+
+    :param universe: The universe.
+    :param path: Path to the universe file.
+    """
+    data = {'systems': {key: asdict(value) for key, value in universe.systems.items()},
+            'constellations': {key: asdict(value) for key, value in universe.constellations.items()},
+            'regions': {key: asdict(value) for key, value in universe.regions.items()}}
+    await asyncio.get_event_loop().run_in_executor(None, write_universe, path, data)
+
+
+async def gather_limited(coro, ids: list, limit: int = 20) -> list:
+    """Call a coroutine function for every ID concurrently, with at most limit calls in flight.
+
+    :param coro: The coroutine function.
+    :param ids: The IDs.
+    :param limit: Max number of concurrent calls.
+    :return: A list with the results.
+    """
+    semaphore = asyncio.Semaphore(limit)
+
+    async def call(_id):
+        async with semaphore:
+            return await coro(_id)
+
+    return await asyncio.gather(*[call(_id) for _id in ids])
+
+
+async def fetch_complete(coro, ids: list, keys: tuple, tries: int = 2) -> dict:
+    """Fetch regions or constellations, and try the ones that come back without the expected keys again.
+
+    ESI answers with an error dictionary instead of the region or constellation when a request fails.
+
+    :param coro: The coroutine function that fetches one ID.
+    :param ids: The IDs.
+    :param keys: Keys a complete response has.
+    :param tries: Max number of times to fetch an ID.
+    :return: The complete responses by ID, without the IDs that failed every time.
+    """
+    responses = {}
+    missing = list(ids)
+    for _ in range(tries):
+        if not missing:
+            break
+        for _id, response in zip(missing, await gather_limited(coro, missing)):
+            if type(response) is dict and all(response.get(key) is not None for key in keys):
+                responses[_id] = response
+        missing = [_id for _id in missing if _id not in responses]
+    if missing:
+        log.warning(f'Failed to fetch {len(missing)} of {len(ids)} from ESI, like {missing[:10]}')
+    return responses
+
+
+@timeit
+@logger
+async def expand_to_systems(universe: Universe, category: str, names: list, search, get_region, get_constellation,
+                            get_names) -> tuple:
+    """Expand regions or constellations to all of their solar systems.
+
+    The hierarchy is looked up in the universe store. Whatever is missing from the store is fetched from ESI
+    concurrently and added to the store, so expanding the same regions again needs no requests. The store is only
+    written to file when it has every solar system and nothing failed to fetch, so the file is never left partial.
+
+    :param universe: The universe.
+    :param category: 'region' or 'constellation'.
+    :param names: Names of the regions or constellations.
+    :param search: Coroutine function that searches ESI, called with categories and search.
+    :param get_region: Coroutine function that fetches a region from ESI.
+    :param get_constellation: Coroutine function that fetches a constellation from ESI.
+    :param get_names: Coroutine function that resolves IDs to names with ESI.
+    :return: A tuple with a list of system IDs, a list of system names and a list of the names that were not found
+        or failed to fetch.
+    """
+    ids = {name: universe.find(category, name) for name in names}
+    unknown = [name for name, _id in ids.items() if _id is None]
+    for name, response in zip(unknown, await gather_limited(lambda name: search(categories=category, search=name),
+                                                            unknown)):
+        ids[name] = response[0] if response else None
+    fetched = False
+    complete = True
+
+    if category == 'region':
+        missing = [region_id for region_id in ids.values()
+                   if region_id is not None and region_id not in universe.regions]
+        regions = await fetch_complete(get_region, missing, keys=('region_id', 'constellations'))
+        universe.add(regions={region_id: from_dict(cls=Region, dictionary=region)
+                              for region_id, region in regions.items()})
+        fetched |= bool(regions)
+        complete &= len(regions) == len(missing)
+        ids = {name: region_id if region_id in universe.regions else None for name, region_id in ids.items()}
+        constellation_ids = {name: universe.regions[region_id].constellations if region_id is not None else None
+                             for name, region_id in ids.items()}
+    else:
+        constellation_ids = {name: [constellation_id] if constellation_id is not None else None
+                             for name, constellation_id in ids.items()}
+
+    missing = list({constellation_id for group in constellation_ids.values() if group is not None
+                    for constellation_id in group if constellation_id not in universe.constellations})
+    constellations = await fetch_complete(get_constellation, missing, keys=('constellation_id', 'systems'))
+    universe.add(constellations={constellation_id: from_dict(cls=Constellation, dictionary=constellation)
+                                 for constellation_id, constellation in constellations.items()})
+    fetched |= bool(constellations)
+    complete &= len(constellations) == len(missing)
+
+    not_found = [name for name, group in constellation_ids.items()
+                 if group is None or any(constellation_id not in universe.constellations for constellation_id in group)]
+    system_ids = [system_id for name, group in constellation_ids.items() if name not in not_found
+                  for constellation_id in group for system_id in universe.constellations[constellation_id].systems]
+
+    if fetched and complete and universe.systems and all(system_id in universe.systems for system_id in system_ids):
+        await save_universe(universe)
+
+    names = {system_id: universe.systems[system_id].name for system_id in system_ids if system_id in universe.systems}
+    missing = [system_id for system_id in system_ids if system_id not in names]
+    if missing:
+        names.update({element.get('id'): element.get('name') for element in await get_names(missing)})
+    return system_ids, [names.get(system_id) for system_id in system_ids], not_found